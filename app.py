@@ -1,18 +1,27 @@
-import gradio as gr
-import anthropic
-import fitz  # PyMuPDF
-from PIL import Image
 from dotenv import load_dotenv
 import os
-import io
 import re
 import ast
 import json
 import base64
 import time
-
-from prompt import PROMPT, SYSTEM_ANALISI_FINALE, build_prompt_analisi_finale
-from service.service_main import carica_tariffario_csv, pulisci_codice, normalizza_codice, trova_codice_simile
+import threading
+from collections import ChainMap, Counter
+
+# Import leggeri all'avvio: gradio, anthropic, fitz e PIL vengono importati solo quando servono
+from prompt import PROMPT, PROMPT_MULTIPAGINA, SYSTEM_ANALISI_FINALE, build_prompt_analisi_finale
+from service.service_main import (
+    carica_tariffario_csv, pulisci_codice, normalizza_codice, trova_codice_simile, IndiceCanonico, OUTPUT_DIR,
+    mappa_normalizzata,
+)
+from service.client_claude import ClientClaudeResiliente, CircuitoApertoError
+from service.export import EsportatoreRisultati, verifica_formati
+from service.archivio import ArchivioRisultati, hash_file, PATH_ARCHIVIO, ALIAS_CONFERMATO, ALIAS_RIFIUTATO
+from service.raccolta import RaccoltaRisposte
+from service.triage import classifica_pagina, stima_token_pagina, VOCI
+from service.pacchetti import pianifica_pacchetti, dividi_risposta_per_pagina
+from service.cascata import StatisticheModelli, numeri_text_layer, valuta_confidenza
+from service.indice_nazionale import IndiceNazionale, ShardTariffario
 
 
 def log(msg):
@@ -21,42 +30,166 @@ def log(msg):
     print(f"[{timestamp}] {msg}")
 
 load_dotenv()
-client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
 
-# Precaricamento del tariffario
 TARIFFARIO_NAME = os.environ.get("TARIFFARIO_NAME", "Tariffario2026C")
 TARIFFARIO_PATH = os.environ.get("TARIFFARIO_PATH", "./Tariffario2026C.csv")
+# Formati di export dei risultati in OUTPUT_DIR (csv, xlsx, parquet); vuoto per disattivare.
+# Validati all'avvio: un formato sconosciuto o una dipendenza mancante bloccano subito l'applicazione
+EXPORT_FORMATI = verifica_formati(os.environ.get("EXPORT_FORMATI", "csv").split(","))
+# Se attivo, un PDF gia' elaborato con lo stesso tariffario viene restituito dall'archivio senza chiamare Claude
+ARCHIVIO_RIUSA = os.environ.get("ARCHIVIO_RIUSA", "1") == "1"
+# Secondi di attesa massima del tariffario per una richiesta arrivata durante il caricamento
+ATTESA_TARIFFARIO = float(os.environ.get("ATTESA_TARIFFARIO", "120"))
+# Budget di memoria per pagina in elaborazione (rendering e richiesta) e per le risposte grezze in RAM
+MEMORIA_MAX_MB = int(os.environ.get("MEMORIA_MAX_MB", "256"))
+# Numero di documenti elaborati in parallelo dalla coda di Gradio
+GRADIO_CONCORRENZA = int(os.environ.get("GRADIO_CONCORRENZA", "4"))
+# Triage locale delle pagine prima dell'invio a Claude: off, conservativo, aggressivo
+TRIAGE_PAGINE = os.environ.get("TRIAGE_PAGINE", "conservativo")
+# Accorpamento delle pagine sparse: massimo pagine per richiesta (1 disattiva) e soglia di codici per pagina
+PACCHETTO_MAX_PAGINE = int(os.environ.get("PACCHETTO_MAX_PAGINE", "4"))
+PAGINA_SPARSA_MAX_CODICI = int(os.environ.get("PAGINA_SPARSA_MAX_CODICI", "5"))
+# Cascata di modelli: le pagine vanno prima al modello veloce (vuoto per disattivare),
+# quelle poco affidabili al modello accurato
+MODELLO_VELOCE = os.environ.get("MODELLO_VELOCE", "claude-haiku-4-5")
+MODELLO_ACCURATO = os.environ.get("MODELLO_ACCURATO", "claude-sonnet-4-5-20250929")
+# Quota minima di codici presenti nel tariffario per accettare la lettura del modello veloce
+SOGLIA_CONFIDENZA_TARIFFARIO = float(os.environ.get("SOGLIA_CONFIDENZA_TARIFFARIO", "0.8"))
+# Indice nazionale dei prezziari regionali in Prezziari/: i codici con prefisso regionale (es. CAM25_)
+# vengono confrontati con lo shard della loro regione; massimo numero di regioni tenute in memoria
+INDICE_NAZIONALE = os.environ.get("INDICE_NAZIONALE", "1") == "1"
+PREZZIARI_MAX_SHARD = int(os.environ.get("PREZZIARI_MAX_SHARD", "4"))
+
+# Stato popolato dal thread di caricamento (vedi avvia_caricamento_tariffario)
+TARIFFARIO = {}
+TARIFFARIO_NORM = {}
+TARIFFARIO_CANONICO = None
+TARIFFARIO_ID = None
+TARIFFARIO_PRONTO = threading.Event()
+ERRORE_CARICAMENTO = None
+
+_client = None
+_client_lock = threading.Lock()
+_archivio = None
+_archivio_lock = threading.Lock()
+_indice_nazionale = None
+_indice_nazionale_lock = threading.Lock()
+
+
+def get_client():
+    """Client condiviso, creato al primo uso: i retry sono gestiti dal wrapper, non dall'SDK."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            import anthropic
+
+            _client = ClientClaudeResiliente(
+                anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"), max_retries=0),
+                max_tentativi=int(os.environ.get("CLAUDE_MAX_TENTATIVI", "6")),
+                soglia_circuito=int(os.environ.get("CLAUDE_SOGLIA_CIRCUITO", "5")),
+                pausa_circuito=float(os.environ.get("CLAUDE_PAUSA_CIRCUITO", "30")),
+                richieste_al_minuto=float(os.environ.get("CLAUDE_RICHIESTE_MINUTO", "50")),
+                token_al_minuto=float(os.environ.get("CLAUDE_TOKEN_MINUTO", "40000")),
+                log=log,
+            )
+        return _client
 
-if not os.path.exists(TARIFFARIO_PATH):
-    raise FileNotFoundError(
-        f"File tariffario non trovato: {TARIFFARIO_PATH}. "
-        f"Verifica le variabili TARIFFARIO_NAME e TARIFFARIO_PATH nel file .env"
-    )
 
-log(f"Caricamento tariffario '{TARIFFARIO_NAME}' da {TARIFFARIO_PATH}...")
-TARIFFARIO = carica_tariffario_csv(TARIFFARIO_PATH)
-# Precomputa mappa normalizzata: {codice_normalizzato: chiave_xcode}
-TARIFFARIO_NORM = {}
-for xcode_key in TARIFFARIO:
-    norm_key = normalizza_codice(xcode_key)
-    if norm_key not in TARIFFARIO_NORM:
-        TARIFFARIO_NORM[norm_key] = xcode_key
-log(f"Tariffario '{TARIFFARIO_NAME}' caricato: {len(TARIFFARIO)} voci")
+def get_archivio():
+    """Archivio persistente dei risultati, aperto al primo uso."""
+    global _archivio
+    with _archivio_lock:
+        if _archivio is None:
+            _archivio = ArchivioRisultati(os.environ.get("ARCHIVIO_PATH", PATH_ARCHIVIO))
+        return _archivio
 
 
-def img_to_base64(img):
-    """Converte un'immagine PIL in stringa base64 PNG."""
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    return base64.standard_b64encode(buf.getvalue()).decode("utf-8")
+def get_indice_nazionale():
+    """Indice dei prezziari regionali: la tabella dei prefissi si costruisce al primo uso, gli shard su richiesta."""
+    global _indice_nazionale
+    with _indice_nazionale_lock:
+        if _indice_nazionale is None:
+            _indice_nazionale = IndiceNazionale(
+                max_shard=PREZZIARI_MAX_SHARD, registra=get_archivio().registra_tariffario, log=log
+            )
+        return _indice_nazionale
+
+
+def mappa_norm_per_codici(codici):
+    """TARIFFARIO_NORM esteso agli shard regionali dei prefissi presenti tra i codici."""
+    if not INDICE_NAZIONALE:
+        return TARIFFARIO_NORM
+    codici = [pulisci_codice(codice) for codice in codici]
+    indice = get_indice_nazionale()
+    shard = indice.shard_per_codici(codici)
+    # Negli shard senza prefisso i codici letti si cercano senza il prefisso regionale
+    senza_prefisso = {}
+    for codice in codici:
+        shard_regione = shard.get(indice.regione(codice))
+        if shard_regione is not None and shard_regione.senza_prefisso:
+            chiave = shard_regione.norm.get(normalizza_codice(shard_regione.chiave(codice)))
+            if chiave:
+                senza_prefisso[normalizza_codice(codice)] = chiave
+    return ChainMap(senza_prefisso, *(shard_regione.norm for shard_regione in shard.values()), TARIFFARIO_NORM)
+
+
+def carica_tariffario():
+    """Carica il tariffario, costruisce gli indici e registra la versione nell'archivio."""
+    global TARIFFARIO, TARIFFARIO_NORM, TARIFFARIO_CANONICO, TARIFFARIO_ID, ERRORE_CARICAMENTO
 
+    try:
+        inizio = time.perf_counter()
+        log(f"Caricamento tariffario '{TARIFFARIO_NAME}' da {TARIFFARIO_PATH}...")
+        tariffario = carica_tariffario_csv(TARIFFARIO_PATH)
+        # Precomputa mappa normalizzata: {codice_normalizzato: chiave_xcode}
+        tariffario_norm = mappa_normalizzata(tariffario)
+        # Indice canonico tollerante alle confusioni OCR e a un carattere in piu'/in meno
+        tariffario_canonico = IndiceCanonico(tariffario)
+
+        # Nell'archivio la versione del tariffario e' identificata dall'hash del file
+        tariffario_id = get_archivio().registra_tariffario(
+            TARIFFARIO_NAME, hash_file(TARIFFARIO_PATH), len(tariffario)
+        )
 
-def parse_liste_da_testo(testo):
-    """
-    Estrae liste di tuple dal testo restituito da Claude.
-    Aggrega le quantita' per codici che si normalizzano allo stesso valore,
-    risolvendo inconsistenze tra pagine (underscore vs punti, ecc.).
-    """
+        TARIFFARIO, TARIFFARIO_NORM, TARIFFARIO_CANONICO = tariffario, tariffario_norm, tariffario_canonico
+        TARIFFARIO_ID = tariffario_id
+        log(f"Tariffario '{TARIFFARIO_NAME}' caricato: {len(TARIFFARIO)} voci "
+            f"({len(TARIFFARIO_CANONICO.collisioni())} chiavi canoniche condivise) "
+            f"in {time.perf_counter() - inizio:.1f}s")
+    except Exception as e:
+        ERRORE_CARICAMENTO = e
+        log(f"ERRORE caricamento tariffario: {e}")
+        raise
+    finally:
+        TARIFFARIO_PRONTO.set()
+
+
+def avvia_caricamento_tariffario():
+    """Avvia il caricamento del tariffario in un thread in background."""
+    if not os.path.exists(TARIFFARIO_PATH):
+        raise FileNotFoundError(
+            f"File tariffario non trovato: {TARIFFARIO_PATH}. "
+            f"Verifica le variabili TARIFFARIO_NAME e TARIFFARIO_PATH nel file .env"
+        )
+    thread = threading.Thread(target=carica_tariffario, name="caricamento-tariffario", daemon=True)
+    thread.start()
+    return thread
+
+
+def tariffario_principale() -> ShardTariffario:
+    """Il tariffario CSV caricato all'avvio, con gli stessi attributi degli shard regionali."""
+    return ShardTariffario(
+        TARIFFARIO_NAME, TARIFFARIO, TARIFFARIO_ID, norm=TARIFFARIO_NORM, canonico=TARIFFARIO_CANONICO
+    )
+
+
+def tariffario_pronto() -> bool:
+    """True quando tariffario e indici sono caricati correttamente."""
+    return TARIFFARIO_PRONTO.is_set() and ERRORE_CARICAMENTO is None
+
+
+def estrai_tuple_da_testo(testo):
+    """Estrae le tuple (codice, quantita') dalle liste Python presenti nel testo restituito da Claude."""
     matches = re.findall(r'\[.*?\]', testo, re.DOTALL)
     tutte = []
     for match in matches:
@@ -70,113 +203,309 @@ def parse_liste_da_testo(testo):
                             tutte.append((codice.strip(), float(quantita)))
         except (ValueError, SyntaxError):
             continue
+    return tutte
+
 
-    # Aggrega per codice normalizzato: tiene il primo codice raw trovato
-    # e somma le quantita' se lo stesso codice appare da pagine diverse
-    aggregati = {}  # normalizzato -> (codice_raw, quantita_totale)
-    for codice, quantita in tutte:
+class AggregatoreCodici:
+    """
+    Aggregazione incrementale delle coppie (codice, quantita') per codice normalizzato:
+    tiene il primo codice raw trovato e somma le quantita' se lo stesso codice appare
+    da pagine diverse. La memoria dipende solo dal numero di codici distinti.
+    """
+
+    def __init__(self):
+        self.aggregati = {}  # normalizzato -> (codice_raw, quantita_totale)
+
+    def aggiungi(self, codice, quantita):
         chiave = normalizza_codice(codice)
-        if chiave in aggregati:
-            raw_esistente, qty_esistente = aggregati[chiave]
+        if chiave in self.aggregati:
+            raw_esistente, qty_esistente = self.aggregati[chiave]
             # Se la quantita' e' identica, e' un duplicato da pagine sovrapposte
             if qty_esistente == quantita:
-                continue
+                return
             # Altrimenti somma (casi di codice spezzato su piu' coppie di pagine)
-            aggregati[chiave] = (raw_esistente, qty_esistente + quantita)
+            self.aggregati[chiave] = (raw_esistente, qty_esistente + quantita)
         else:
-            aggregati[chiave] = (codice, quantita)
+            self.aggregati[chiave] = (codice, quantita)
 
-    risultato = [(raw, qty) for raw, qty in aggregati.values()]
-    return sorted(risultato)
+    def risultato(self):
+        return sorted((raw, qty) for raw, qty in self.aggregati.values())
 
 
-def estrai_codici_da_pdf(pdf_file, modello="claude-sonnet-4-5-20250929", dpi=200):
-    """Estrae coppie (codice, quantità) dal PDF usando Claude."""
+def parse_liste_da_testo(testo):
+    """
+    Estrae liste di tuple dal testo restituito da Claude.
+    Aggrega le quantita' per codici che si normalizzano allo stesso valore,
+    risolvendo inconsistenze tra pagine (underscore vs punti, ecc.).
+    """
+    aggregatore = AggregatoreCodici()
+    for codice, quantita in estrai_tuple_da_testo(testo):
+        aggregatore.aggiungi(codice, quantita)
+    return aggregatore.risultato()
+
+
+def _matrice_rendering(fitz, page, dpi, memoria_max):
+    """
+    Matrice di rendering della pagina. Se pixmap, PNG, base64 e corpo della richiesta
+    (circa quattro copie della bitmap RGB) superano il budget, la risoluzione viene ridotta.
+    """
+    zoom = dpi / 72
+    stima = page.rect.width * zoom * page.rect.height * zoom * 3 * 4
+    if stima > memoria_max:
+        zoom *= (memoria_max / stima) ** 0.5
+    return fitz.Matrix(zoom, zoom)
+
+
+def renderizza_pagina_base64(fitz, page, dpi, memoria_max):
+    """Renderizza una pagina direttamente in PNG base64, senza passare da un'immagine PIL."""
+    pix = page.get_pixmap(matrix=_matrice_rendering(fitz, page, dpi, memoria_max))
+    png = pix.tobytes("png")
+    del pix
+    return base64.standard_b64encode(png).decode("ascii")
+
+
+def invia_pacchetto(fitz, doc, pacchetto, modello, dpi, memoria_max, statistiche=None):
+    """
+    Invia a Claude una o piu' pagine in un'unica richiesta, ciascuna preceduta dal
+    marcatore "--- PAGINA N ---", e restituisce {numero_pagina: testo_risposta}; le pagine
+    senza marcatore nella risposta, o tutte se la risposta e' troncata, mancano dal dict. Latenza e token della chiamata vengono registrati in `statistiche` se fornito.
+    """
+    numeri = [i + 1 for i in pacchetto]
+    # Il budget di memoria e' condiviso tra le immagini della richiesta
+    memoria_pagina = memoria_max // len(pacchetto)
+    content = []
+    for i in pacchetto:
+        content.append({"type": "text", "text": f"\n--- PAGINA {i + 1} ---"})
+        content.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/png",
+                "data": renderizza_pagina_base64(fitz, doc[i], dpi, memoria_pagina),
+            },
+        })
+
+    inizio = time.perf_counter()
+    response = get_client().crea_messaggio(
+        model=modello,
+        max_tokens=4096,
+        system=PROMPT if len(pacchetto) == 1 else PROMPT_MULTIPAGINA,
+        messages=[{"role": "user", "content": content}],
+    )
+    del content
+    if statistiche is not None:
+        statistiche.registra(modello, len(pacchetto), time.perf_counter() - inizio, getattr(response, "usage", None))
+
+    if getattr(response, "stop_reason", None) == "max_tokens":
+        # Risposta troncata: l'ultima lista resterebbe aperta e la pagina risulterebbe senza voci
+        etichetta = f"pagina {numeri[0]}" if len(numeri) == 1 else f"pagine {', '.join(map(str, numeri))}"
+        log(f"  ATTENZIONE: risposta troncata ({etichetta}), pagine da considerare non elaborate")
+        return {}
+    segmenti, attribuzione_certa = dividi_risposta_per_pagina(response.content[0].text, numeri)
+    if not attribuzione_certa:
+        log(f"  ATTENZIONE: risposta senza marcatori di pagina per le pagine {', '.join(map(str, numeri))}")
+    return segmenti
+
+
+def estrai_codici_da_pdf(pdf_file, modello=MODELLO_ACCURATO, dpi=200, on_pagina=None, tempi=None, pagine_fallite=None):
+    """
+    Estrae coppie (codice, quantità) dal PDF usando Claude.
+    Se fornito, on_pagina(numero_pagina, risposta_raw) viene chiamato per ogni pagina elaborata;
+    se fornito, il dict `tempi` riceve la durata delle fasi 'triage', 'modello' e 'rendering' in secondi;
+    se fornita, la lista `pagine_fallite` riceve i numeri delle pagine non elaborate.
+
+    Con MODELLO_VELOCE impostato le pagine passano prima dal modello veloce; quelle che non
+    superano la verifica locale di confidenza vengono rielaborate con `modello`.
+
+    Il documento viene elaborato in streaming: una richiesta alla volta (una pagina, o poche
+    pagine sparse consecutive accorpate) viene renderizzata, inviata e aggregata, poi rilasciata.
+    Il picco di memoria e' limitato da MEMORIA_MAX_MB indipendentemente dal numero di pagine.
+    """
     log("=" * 60)
     log("INIZIO ELABORAZIONE PDF")
     log("=" * 60)
 
+    import fitz  # PyMuPDF
+
+    memoria_max = MEMORIA_MAX_MB * 1024 * 1024
+
     log(f"Apertura PDF: {pdf_file}")
     doc = fitz.open(pdf_file)
-    zoom = dpi / 72
-    matrix = fitz.Matrix(zoom, zoom)
-    immagini = []
     numero_pagine = len(doc)
     log(f"PDF aperto: {numero_pagine} pagine trovate")
 
-    log("Conversione pagine in immagini...")
-    for idx, page in enumerate(doc):
-        num_pag = idx + 1
-        log(f"  Lettura pagina {num_pag}/{numero_pagine}...")
-        pix = page.get_pixmap(matrix=matrix)
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
-        immagini.append(img)
-    doc.close()
-    log(f"Conversione completata: {numero_pagine} immagini generate ({dpi} DPI)")
-
     if numero_pagine < 1:
+        doc.close()
         log("ERRORE: il PDF non contiene pagine.")
         return [], "Il PDF non contiene pagine."
 
-    risposte_raw = []
+    if tempi is None:
+        tempi = {}
 
+    # Triage locale: solo le pagine con tabelle di voci vengono inviate a Claude
+    inizio_fase = time.perf_counter()
     log("-" * 60)
-    log(f"ANALISI CODICI CON CLAUDE ({numero_pagine} pagine, una alla volta)")
+    log(f"TRIAGE PAGINE (modalita' {TRIAGE_PAGINE})")
     log("-" * 60)
-
-    for i in range(numero_pagine):
-        num_pag = i + 1
-        img = immagini[i]
-
-        log(f"  Invio pagina {num_pag} a Claude... [{num_pag}/{numero_pagine}]")
-
-        content = [
-            {"type": "text", "text": f"\n--- PAGINA {num_pag} ---"},
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": img_to_base64(img),
-                },
-            },
-        ]
-
+    classificazioni = [classifica_pagina(fitz, doc[i], TRIAGE_PAGINE) for i in range(numero_pagine)]
+    da_inviare = [i for i, c in enumerate(classificazioni) if c["tipo"] == VOCI]
+    if not da_inviare:
+        # Fallback conservativo: nessuna pagina riconosciuta, si inviano tutte
+        log("  Nessuna pagina con voci riconosciuta: invio di tutte le pagine")
+        da_inviare = list(range(numero_pagine))
+    token_prompt = len(PROMPT) // 4
+    token_risparmiati = 0
+    inviate = set(da_inviare)
+    for i, c in enumerate(classificazioni):
+        if i not in inviate:
+            token_risparmiati += stima_token_pagina(doc[i], dpi, token_prompt)
+            log(f"  Pagina {i + 1}: {c['tipo']} ({c['motivo']}) -> saltata")
+    log(f"Triage: {len(da_inviare)}/{numero_pagine} pagine da inviare, "
+        f"{numero_pagine - len(da_inviare)} chiamate risparmiate (~{token_risparmiati} token di input)")
+
+    # Le pagine sparse consecutive vengono accorpate in un'unica richiesta
+    pacchetti = pianifica_pacchetti(
+        da_inviare, classificazioni,
+        max_pagine=PACCHETTO_MAX_PAGINE, max_codici=PAGINA_SPARSA_MAX_CODICI,
+    )
+    tempi["triage"] = time.perf_counter() - inizio_fase
+    inizio_fase = time.perf_counter()
+
+    aggregatore = AggregatoreCodici()
+    if pagine_fallite is None:
+        pagine_fallite = []
+    pagine_scalate = []
+    statistiche = StatisticheModelli()
+    cascata = bool(MODELLO_VELOCE) and MODELLO_VELOCE != modello
+
+    def accetta(num_pag, testo_pagina, tuple_pagina):
+        for codice, quantita in tuple_pagina:
+            aggregatore.aggiungi(codice, quantita)
+        if on_pagina is not None:
+            on_pagina(num_pag, testo_pagina)
+        log(f"  Risposta ricevuta per pagina {num_pag} ({len(tuple_pagina)} voci)")
+
+    def invia(pacchetto, modello_pacchetto):
+        """
+        Invia un pacchetto e ritorna {numero_pagina: testo}. Le pagine assenti dalla risposta
+        di un pacchetto vengono reinviate da sole; quelle ancora assenti (o l'intero pacchetto
+        in caso di errore) mancano dal dict e vanno considerate fallite.
+        """
+        numeri = [i + 1 for i in pacchetto]
+        etichetta = f"pagina {numeri[0]}" if len(numeri) == 1 else f"pagine {', '.join(map(str, numeri))}"
+        log(f"  Invio {etichetta} a {modello_pacchetto}... [{numeri[-1]}/{numero_pagine}] "
+            f"({'; '.join(classificazioni[i]['motivo'] for i in pacchetto)})")
         try:
-            response = client.messages.create(
-                model=modello,
-                max_tokens=4096,
-                system=PROMPT,
-                messages=[{"role": "user", "content": content}],
-            )
-            testo_risposta = response.content[0].text
-            risposte_raw.append(testo_risposta)
-            # Conta voci estratte da questa pagina
-            voci_pagina = len(re.findall(r'\(', testo_risposta.split('[')[-1])) if '[' in testo_risposta else 0
-            log(f"  Risposta ricevuta per pagina {num_pag} (~{voci_pagina} voci)")
+            segmenti = invia_pacchetto(fitz, doc, pacchetto, modello_pacchetto, dpi, memoria_max, statistiche)
+        except CircuitoApertoError:
+            # API non disponibile: si interrompe il documento invece di perdere le pagine una a una
+            raise
         except Exception as e:
-            log(f"  ERRORE pagina {num_pag}: {e}")
-            risposte_raw.append(f"ERRORE pagina {num_pag}: {e}")
+            log(f"  ERRORE {etichetta} ({modello_pacchetto}): {e}")
+            return {}
+        finally:
+            # Svuota la cache interna di MuPDF (font e immagini decodificate delle pagine)
+            fitz.TOOLS.store_shrink(100)
+
+        mancanti = [i for i in pacchetto if i + 1 not in segmenti]
+        if mancanti and len(pacchetto) > 1:
+            log(f"  Pagine {', '.join(str(i + 1) for i in mancanti)} assenti dalla risposta: reinvio singolo")
+            for i in mancanti:
+                segmenti.update(invia([i], modello_pacchetto))
+        return segmenti
+
+    log("-" * 60)
+    log(f"ANALISI CODICI CON CLAUDE ({len(da_inviare)} pagine in {len(pacchetti)} richieste, {dpi} DPI"
+        + (f", cascata {MODELLO_VELOCE} -> {modello})" if cascata else f", {modello})"))
+    log("-" * 60)
+
+    try:
+        for pacchetto in pacchetti:
+            if not cascata:
+                segmenti = invia(pacchetto, modello)
+                # Le pagine senza risposta restano fallite: vengono riportate nel log invece di finire nel testo
+                pagine_fallite.extend(i + 1 for i in pacchetto if i + 1 not in segmenti)
+                for num_pag, testo_pagina in segmenti.items():
+                    accetta(num_pag, testo_pagina, estrai_tuple_da_testo(testo_pagina))
+                continue
+
+            # Cascata: prima il modello veloce, poi solo le pagine poco affidabili al modello accurato
+            segmenti = invia(pacchetto, MODELLO_VELOCE)
+            da_scalare = []
+            for i in pacchetto:
+                num_pag = i + 1
+                if num_pag not in segmenti:
+                    log(f"  Pagina {num_pag} senza risposta da {MODELLO_VELOCE}: riverifica con {modello}")
+                    da_scalare.append(i)
+                    continue
+                testo_pagina = segmenti[num_pag]
+                tuple_pagina = estrai_tuple_da_testo(testo_pagina)
+                affidabile, motivo = valuta_confidenza(
+                    testo_pagina, tuple_pagina, mappa_norm_per_codici(codice for codice, _ in tuple_pagina),
+                    numeri_pagina=numeri_text_layer(doc[i]),
+                    codici_attesi=classificazioni[i]["codici"],
+                    soglia_tariffario=SOGLIA_CONFIDENZA_TARIFFARIO,
+                )
+                if affidabile:
+                    accetta(num_pag, testo_pagina, tuple_pagina)
+                else:
+                    log(f"  Pagina {num_pag} da riverificare con {modello}: {motivo}")
+                    da_scalare.append(i)
+
+            pagine_scalate.extend(i + 1 for i in da_scalare)
+            for sotto_pacchetto in pianifica_pacchetti(
+                da_scalare, classificazioni,
+                max_pagine=PACCHETTO_MAX_PAGINE, max_codici=PAGINA_SPARSA_MAX_CODICI,
+            ):
+                segmenti = invia(sotto_pacchetto, modello)
+                pagine_fallite.extend(i + 1 for i in sotto_pacchetto if i + 1 not in segmenti)
+                for num_pag, testo_pagina in segmenti.items():
+                    accetta(num_pag, testo_pagina, estrai_tuple_da_testo(testo_pagina))
+    except CircuitoApertoError as e:
+        log(f"ERRORE: elaborazione interrotta, API di Claude non disponibile: {e}")
+        return [], f"Elaborazione interrotta: API di Claude non disponibile ({e}). Riprova piu' tardi."
+    finally:
+        doc.close()
+    # Tempo nelle chiamate (attese del rate limiter e retry inclusi) e resto del ciclo (rendering, parsing)
+    tempi["modello"] = sum(v["latenza"] for v in statistiche.livelli.values())
+    tempi["rendering"] = max(0.0, time.perf_counter() - inizio_fase - tempi["modello"])
+
+    for riga in statistiche.righe():
+        log(f"  {riga}")
 
     log("-" * 60)
     log("AGGREGAZIONE RISULTATI")
     log("-" * 60)
 
-    testo_completo = "\n".join(risposte_raw)
-    lista_finale = parse_liste_da_testo(testo_completo)
+    lista_finale = aggregatore.risultato()
 
     log(f"Voci estratte dopo aggregazione: {len(lista_finale)}")
 
-    log_str = f"Pagine elaborate: {numero_pagine} | Voci estratte: {len(lista_finale)}"
+    log_str = (
+        f"Pagine elaborate: {len(da_inviare) - len(pagine_fallite)}/{numero_pagine} | "
+        f"Richieste: {sum(v['richieste'] for v in statistiche.livelli.values())} | "
+        f"Pagine saltate dal triage: {numero_pagine - len(da_inviare)} (~{token_risparmiati} token) | "
+        f"Voci estratte: {len(lista_finale)}"
+    )
+    if cascata:
+        log_str += f" | Pagine riverificate con {modello}: {len(pagine_scalate)}"
+    if pagine_fallite:
+        log(f"ATTENZIONE: pagine non elaborate dopo i tentativi: {pagine_fallite}")
+        log_str += f" | Pagine fallite: {', '.join(str(p) for p in pagine_fallite)}"
     return lista_finale, log_str
 
 
-def analisi_finale_claude(risultati, non_trovati, tariffario, modello="claude-sonnet-4-5-20250929"):
+def analisi_finale_claude(
+    risultati, non_trovati, tariffario, modello=MODELLO_ACCURATO, risolti=None, rifiutati=frozenset()
+):
     """
     Chiede a Claude di analizzare i risultati finali per:
     1. Trovare e rimuovere doppioni (tiene la quantità più alta)
     2. Inserire voci mancanti copiando la descrizione dal tariffario
     Non modifica le voci già correttamente inserite.
+    Se fornito, il dict `risolti` riceve {codice_non_trovato: chiave_tariffario} per i codici recuperati.
+    Gli alias rifiutati in `rifiutati` ({(codice_norm, chiave)}) non vengono proposti a Claude e le voci
+    recuperate con una di quelle chiavi vengono scartate: il codice resta tra i non trovati.
     """
     log("-" * 60)
     log("ANALISI FINALE CON CLAUDE (deduplicazione e voci mancanti)")
@@ -201,11 +530,18 @@ def analisi_finale_claude(risultati, non_trovati, tariffario, modello="claude-so
 
     # Prepara un estratto del tariffario con i codici più simili ai non trovati
     codici_tariffario_sample = []
+    rifiutate_per_codice = {}
     for codice_nt, _ in non_trovati:
         xcode = pulisci_codice(codice_nt)
+        codice_norm = normalizza_codice(xcode)
+        rifiutate = {chiave for norm, chiave in rifiutati if norm == codice_norm}
+        if rifiutate:
+            rifiutate_per_codice[codice_nt] = rifiutate
         # Prendi i primi caratteri come prefisso per filtrare
         prefisso = xcode[:6] if len(xcode) >= 6 else xcode
         for chiave, voce in tariffario.items():
+            if chiave in rifiutate:
+                continue
             if chiave.startswith(prefisso) and len(codici_tariffario_sample) < 50:
                 codici_tariffario_sample.append(
                     f"  {voce['codice']} | {voce['descrizione']} | {voce['unita']} | {voce['prezzo']}"
@@ -217,7 +553,7 @@ def analisi_finale_claude(risultati, non_trovati, tariffario, modello="claude-so
     log("  Invio dati a Claude per analisi finale...")
 
     try:
-        response = client.messages.create(
+        response = get_client().crea_messaggio(
             model=modello,
             max_tokens=8192,
             system=SYSTEM_ANALISI_FINALE,
@@ -264,6 +600,27 @@ def analisi_finale_claude(risultati, non_trovati, tariffario, modello="claude-so
             log("  ATTENZIONE: parsing JSON ha prodotto risultati vuoti, mantengo gli originali")
             return risultati, [c for c, _ in non_trovati]
 
+        # Voci recuperate con un alias rifiutato: si scartano le righe in piu' rispetto agli originali
+        originali = Counter(pulisci_codice(r[0]) for r in risultati)
+        for codice_nt, rifiutate in rifiutate_per_codice.items():
+            for chiave in rifiutate:
+                righe_chiave = [r for r in risultati_nuovi if pulisci_codice(r[0]) == chiave]
+                for riga in righe_chiave[originali[chiave]:]:
+                    risultati_nuovi.remove(riga)
+                    log(f"  Scartata voce recuperata con alias rifiutato: {codice_nt} -> {riga[0]}")
+                    if codice_nt not in non_trovati_nuovi:
+                        non_trovati_nuovi.append(codice_nt)
+
+        # Corrispondenze dichiarate da Claude, tenute solo se riferite a codici reali e non rifiutate
+        if risolti is not None and isinstance(data.get("risolti"), dict):
+            codici_richiesti = {c for c, _ in non_trovati}
+            for codice_nt, codice_tariffario in data["risolti"].items():
+                chiave = pulisci_codice(str(codice_tariffario))
+                if chiave in rifiutate_per_codice.get(codice_nt, ()):
+                    continue
+                if codice_nt in codici_richiesti and codice_nt not in non_trovati_nuovi and chiave in tariffario:
+                    risolti[codice_nt] = chiave
+
         # Log delle modifiche
         diff_count = len(risultati) - len(risultati_nuovi)
         if diff_count > 0:
@@ -287,18 +644,85 @@ def analisi_finale_claude(risultati, non_trovati, tariffario, modello="claude-so
         return risultati, [c for c, _ in non_trovati]
 
 
+def fonti_invariate(documento) -> bool:
+    """
+    True se le fonti usate da un documento archiviato sono ancora quelle attuali: stessi file
+    dei prezziari regionali e nessun alias confermato o rifiutato da allora.
+    """
+    if not documento.get("fonti"):
+        return False
+    ids = [int(fonte.split(":")[0]) for fonte in documento["fonti"].split(",")]
+    for tariffario_id in ids:
+        if tariffario_id == TARIFFARIO_ID:
+            continue
+        fonte = get_archivio().tariffario_per_id(tariffario_id)
+        if not INDICE_NAZIONALE or fonte is None:
+            return False
+        if get_indice_nazionale().versione_regione(fonte["nome"]) != fonte["hash"]:
+            return False
+    return get_archivio().versione_fonti(ids) == documento["fonti"]
+
+
 def confronta_pdf_csv(pdf_file):
     """Confronta i codici estratti dal PDF con il Tariffario precaricato."""
     if pdf_file is None:
-        return [], "", "Carica un file PDF."
+        return [], "", "Carica un file PDF.", []
+
+    # Tempi per fase, riportati nel log finale
+    inizio = time.perf_counter()
+    tempi = {}
+
+    # Il tariffario viene caricato in background all'avvio
+    if not TARIFFARIO_PRONTO.wait(timeout=ATTESA_TARIFFARIO):
+        return [], "", "Tariffario in caricamento, riprova tra qualche istante.", []
+    if ERRORE_CARICAMENTO is not None:
+        return [], "", f"Tariffario non disponibile: {ERRORE_CARICAMENTO}", []
+
+    # 0. Documento gia' elaborato con questa versione del tariffario: risponde dall'archivio
+    nome_documento = os.path.basename(str(pdf_file))
+    hash_documento = hash_file(pdf_file)
+    if ARCHIVIO_RIUSA:
+        archiviato = get_archivio().documento_per_hash(hash_documento, TARIFFARIO_ID, solo_completi=True)
+        if archiviato is not None and fonti_invariate(archiviato):
+            log(f"Documento gia' elaborato il {archiviato['elaborato_il']}: risultati dall'archivio")
+            return (
+                archiviato["righe"],
+                archiviato["output"],
+                f"{archiviato['log']} | Da archivio ({archiviato['elaborato_il']})",
+                [],
+            )
 
-    # 1. Estrai codici dal PDF
-    lista_pdf, log_estrazione = estrai_codici_da_pdf(pdf_file)
+    # 1. Estrai codici dal PDF (le risposte grezze oltre il budget vengono riversate su disco)
+    estrazioni = RaccoltaRisposte(max_memoria=MEMORIA_MAX_MB * 1024 * 1024 // 8)
+    pagine_fallite = []
+    lista_pdf, log_estrazione = estrai_codici_da_pdf(
+        pdf_file, on_pagina=estrazioni.aggiungi, tempi=tempi, pagine_fallite=pagine_fallite
+    )
     if not lista_pdf:
-        return [], "", log_estrazione
-
-    # 2. Usa tariffario precaricato
-    tariffario = TARIFFARIO
+        estrazioni.chiudi()
+        return [], "", log_estrazione, []
+
+    # 2. Tariffario precaricato e shard regionali dei soli prefissi presenti nel documento
+    base = tariffario_principale()
+    shard = {}
+    if INDICE_NAZIONALE:
+        indice = get_indice_nazionale()
+        shard = indice.shard_per_codici(codice for codice, _ in lista_pdf)
+        for regione, shard_regione in shard.items():
+            log(f"Prezziario regionale '{regione}': {len(shard_regione.tariffario)} voci")
+
+    def sorgente_per_codice(codice):
+        """
+        Shard della regione indicata dal prefisso del codice, salvo quando il codice manca
+        dallo shard ma e' presente nel tariffario principale; senza shard il tariffario principale.
+        """
+        regionale = shard.get(indice.regione(codice)) if shard else None
+        if regionale is None:
+            return base
+        if regionale.contiene(codice) or not base.contiene(codice):
+            return regionale
+        log(f"  {codice} assente dal prezziario '{regionale.nome}': confronto con il tariffario principale")
+        return base
 
     # 3. Confronta usando xcode (codici puliti) con fallback fuzzy
     log("-" * 60)
@@ -308,29 +732,44 @@ def confronta_pdf_csv(pdf_file):
     risultati = []
     non_trovati = []
     match_fuzzy = []
-
-    for codice_pdf, quantita in lista_pdf:
-        xcode = pulisci_codice(codice_pdf)
-
-        if xcode in tariffario:
-            # Match esatto
-            voce = tariffario[xcode]
-            costo_totale = round(voce['prezzo'] * quantita, 2)
-            risultati.append([
-                voce['codice'],
-                voce['descrizione'],
-                voce['unita'],
-                voce['prezzo'],
-                quantita,
-                costo_totale,
-            ])
-            log(f"  Match esatto: {codice_pdf} -> {voce['codice']}")
-        else:
-            # Fallback: fuzzy matching
-            log(f"  Ricerca fuzzy per: {codice_pdf}...")
-            chiave_simile = trova_codice_simile(xcode, tariffario, TARIFFARIO_NORM)
-            if chiave_simile:
-                voce = tariffario[chiave_simile]
+    match_alias = 0
+    collisioni = []
+    inizio_fase = time.perf_counter()
+
+    # Alias appresi dai documenti precedenti, per versione del tariffario;
+    # le nuove risoluzioni vengono registrate a fine elaborazione
+    alias_sorgenti = {}
+    nuovi_alias = {}
+
+    with EsportatoreRisultati(nome_documento, formati=EXPORT_FORMATI) as export:
+        for codice_pdf, quantita in lista_pdf:
+            xcode = pulisci_codice(codice_pdf)
+            codice_norm = normalizza_codice(xcode)
+            sorgente = sorgente_per_codice(xcode)
+            # Forma del codice nel tariffario scelto; gli alias restano indicizzati sul codice letto
+            xcode = sorgente.chiave(xcode)
+            tariffario = sorgente.tariffario
+            if sorgente.tariffario_id not in alias_sorgenti:
+                alias_sorgenti[sorgente.tariffario_id] = get_archivio().alias_tariffario(sorgente.tariffario_id)
+            alias, alias_rifiutati = alias_sorgenti[sorgente.tariffario_id]
+            chiave_alias, stato_alias = alias.get(codice_norm, (None, None))
+
+            if xcode in tariffario:
+                # Match esatto
+                voce = tariffario[xcode]
+                costo_totale = round(voce['prezzo'] * quantita, 2)
+                risultati.append([
+                    voce['codice'],
+                    voce['descrizione'],
+                    voce['unita'],
+                    voce['prezzo'],
+                    quantita,
+                    costo_totale,
+                ])
+                log(f"  Match esatto: {codice_pdf} -> {voce['codice']}")
+            elif chiave_alias in tariffario:
+                # Risoluzione gia' appresa: nessuna ricerca fuzzy ne' analisi di Claude
+                voce = tariffario[chiave_alias]
                 costo_totale = round(voce['prezzo'] * quantita, 2)
                 risultati.append([
                     voce['codice'],
@@ -340,20 +779,85 @@ def confronta_pdf_csv(pdf_file):
                     quantita,
                     costo_totale,
                 ])
-                match_fuzzy.append(f"{codice_pdf} -> {voce['codice']}")
-                log(f"  Match fuzzy: {codice_pdf} -> {voce['codice']}")
+                nuovi_alias.setdefault(sorgente.tariffario_id, []).append((codice_pdf, chiave_alias, "alias"))
+                if stato_alias == ALIAS_CONFERMATO:
+                    match_alias += 1
+                    log(f"  Match alias: {codice_pdf} -> {voce['codice']}")
+                else:
+                    # Gli alias non ancora confermati restano segnalati come approssimati
+                    match_fuzzy.append(f"{codice_pdf} -> {voce['codice']} (alias proposto)")
+                    export.scrivi_fuzzy(codice_pdf, voce['codice'])
+                    log(f"  Match alias proposto: {codice_pdf} -> {voce['codice']}")
             else:
-                non_trovati.append((codice_pdf, quantita))
-                log(f"  NON TROVATO: {codice_pdf}")
-
-    log(f"Confronto completato: {len(risultati)} trovati, {len(non_trovati)} non trovati")
-
-    # 4. Analisi finale con Claude: deduplicazione e voci mancanti
-    risultati, codici_non_trovati = analisi_finale_claude(
-        risultati, non_trovati, tariffario
-    )
-
-    # 5. Output stringa
+                # Match tollerante in O(1): normalizzazione, poi chiave canonica (confusioni OCR)
+                chiave_norm = sorgente.norm.get(normalizza_codice(xcode))
+                candidati = [chiave_norm] if chiave_norm else sorgente.canonico.cerca(xcode)
+                if len(candidati) > 1:
+                    # Piu' voci compatibili: si segnala la collisione invece di sceglierne una
+                    collisioni.append(f"{codice_pdf} -> {' / '.join(tariffario[c]['codice'] for c in candidati)}")
+                    non_trovati.append((codice_pdf, quantita))
+                    log(f"  COLLISIONE: {codice_pdf} compatibile con {len(candidati)} voci")
+                    continue
+
+                # Le risoluzioni rifiutate in revisione non si ripropongono: si passa alla ricerca successiva
+                rifiutate = {chiave for norm, chiave in alias_rifiutati if norm == codice_norm}
+                for chiave in rifiutate.intersection(candidati):
+                    log(f"  Alias rifiutato: {codice_pdf} -> {tariffario[chiave]['codice']}")
+                if chiave_norm and chiave_norm not in rifiutate:
+                    chiave_simile, origine = chiave_norm, None
+                elif candidati and not chiave_norm and candidati[0] not in rifiutate:
+                    chiave_simile, origine = candidati[0], "canonico"
+                else:
+                    # Fallback: fuzzy matching
+                    log(f"  Ricerca fuzzy per: {codice_pdf}...")
+                    chiave_simile = trova_codice_simile(xcode, tariffario, sorgente.norm, escludi=rifiutate)
+                    origine = "fuzzy"
+                if chiave_simile:
+                    voce = tariffario[chiave_simile]
+                    costo_totale = round(voce['prezzo'] * quantita, 2)
+                    risultati.append([
+                        voce['codice'],
+                        voce['descrizione'],
+                        voce['unita'],
+                        voce['prezzo'],
+                        quantita,
+                        costo_totale,
+                    ])
+                    match_fuzzy.append(f"{codice_pdf} -> {voce['codice']}")
+                    export.scrivi_fuzzy(codice_pdf, voce['codice'])
+                    if origine:
+                        nuovi_alias.setdefault(sorgente.tariffario_id, []).append((codice_pdf, chiave_simile, origine))
+                    log(f"  Match fuzzy: {codice_pdf} -> {voce['codice']}")
+                else:
+                    non_trovati.append((codice_pdf, quantita))
+                    log(f"  NON TROVATO: {codice_pdf}")
+
+        log(f"Confronto completato: {len(risultati)} trovati, {len(non_trovati)} non trovati")
+        tempi["confronto"] = time.perf_counter() - inizio_fase
+
+        # 4. Analisi finale con Claude: deduplicazione e voci mancanti
+        inizio_fase = time.perf_counter()
+        # Claude vede le voci di tutte le fonti usate dal documento
+        tariffario = ChainMap(*(shard_regione.tariffario for shard_regione in shard.values()), TARIFFARIO)
+        risolti = {}
+        # Gli alias rifiutati in revisione valgono anche per le voci recuperate da Claude
+        rifiutati = set().union(*(alias_rifiutati for _, alias_rifiutati in alias_sorgenti.values()))
+        risultati, codici_non_trovati = analisi_finale_claude(
+            risultati, non_trovati, tariffario, risolti=risolti, rifiutati=rifiutati
+        )
+        for codice, chiave in risolti.items():
+            sorgente = next((s for s in (*shard.values(), base) if chiave in s.tariffario), None)
+            if sorgente is not None:
+                nuovi_alias.setdefault(sorgente.tariffario_id, []).append((codice, chiave, "modello"))
+        tempi["analisi finale"] = time.perf_counter() - inizio_fase
+
+        # 5. Export in streaming dei risultati finali
+        for r in risultati:
+            export.scrivi_risultato(r)
+        for codice in codici_non_trovati:
+            export.scrivi_non_trovato(codice)
+
+    # 6. Output stringa
     righe_str = []
     for r in risultati:
         righe_str.append(
@@ -364,47 +868,245 @@ def confronta_pdf_csv(pdf_file):
     if match_fuzzy:
         output_str += f"\n\n--- Codici trovati tramite match approssimato ({len(match_fuzzy)}): ---\n"
         output_str += "\n".join(match_fuzzy)
+    if collisioni:
+        output_str += f"\n\n--- Codici ambigui, compatibili con piu' voci ({len(collisioni)}): ---\n"
+        output_str += "\n".join(collisioni)
     if codici_non_trovati:
         output_str += f"\n\n--- Codici non trovati nel tariffario ({len(codici_non_trovati)}): ---\n"
         output_str += ", ".join(codici_non_trovati)
 
-    # 6. Log finale
+    # 7. Log finale
     log_finale = (
         f"{log_estrazione} | "
-        f"Trovati (esatti): {len(risultati) - len(match_fuzzy)} | "
+        f"Trovati (esatti): {len(risultati) - len(match_fuzzy) - match_alias} | "
+        f"Trovati (alias): {match_alias} | "
         f"Trovati (fuzzy): {len(match_fuzzy)} | "
+        f"Ambigui: {len(collisioni)} | "
         f"Non trovati: {len(codici_non_trovati)}"
     )
+    tempi["totale"] = time.perf_counter() - inizio
+    log_finale += " | Tempi: " + ", ".join(f"{fase} {secondi:.2f}s" for fase, secondi in tempi.items())
+
+    if export.file_prodotti:
+        log(f"File esportati in {OUTPUT_DIR}: {len(export.file_prodotti)}")
+
+    # 8. Archiviazione per le consultazioni successive e apprendimento degli alias.
+    # Un'elaborazione con pagine fallite resta consultabile ma non viene riutilizzata
+    with estrazioni:
+        get_archivio().salva_documento(
+            hash_documento, nome_documento, TARIFFARIO_ID, estrazioni, risultati, log_finale, output_str,
+            completo=not pagine_fallite,
+            fonti=[shard_regione.tariffario_id for shard_regione in shard.values()],
+        )
+    for tariffario_id, alias_documento in nuovi_alias.items():
+        get_archivio().registra_alias(tariffario_id, alias_documento)
 
     log("=" * 60)
     log("ELABORAZIONE COMPLETATA")
     log(f"  {log_finale}")
     log("=" * 60)
 
-    return risultati, output_str, log_finale
+    return risultati, output_str, log_finale, export.file_prodotti
+
+
+def cerca_in_archivio(codice, dal, al):
+    """Storico di un codice dall'archivio, senza chiamate a Claude."""
+    if not codice or not codice.strip():
+        return [], "Inserisci un codice."
+    righe = get_archivio().cerca_codice(codice, dal or None, al or None)
+    return righe, f"{len(righe)} occorrenze di {normalizza_codice(codice)}"
+
+
+def elenco_archivio(nome):
+    """Elenco dei documenti archiviati, filtrabile per nome."""
+    return get_archivio().elenco_documenti(nome or None)
+
+
+def mostra_documento_archiviato(documento_id):
+    """Mostra un documento archiviato per id."""
+    if documento_id is None:
+        return [], "", "Inserisci l'id del documento."
+    documento = get_archivio().documento_per_id(int(documento_id))
+    if documento is None:
+        return [], "", f"Documento {int(documento_id)} non trovato."
+    return documento["righe"], documento["output"], documento["log"]
+
+
+STATI_ALIAS = ["tutti", "proposto", "confermato", "rifiutato"]
+
+
+def _sorgenti_alias():
+    """Tariffario principale e prezziari regionali in memoria."""
+    sorgenti = [tariffario_principale()]
+    if INDICE_NAZIONALE:
+        sorgenti.extend(get_indice_nazionale().shard_caricati())
+    return sorgenti
+
+
+def elenco_alias_tariffario(stato):
+    """Alias appresi per il tariffario corrente e i prezziari regionali in uso, filtrabili per stato."""
+    if not tariffario_pronto():
+        return []
+    righe = []
+    for sorgente in _sorgenti_alias():
+        for riga in get_archivio().elenco_alias(sorgente.tariffario_id, None if stato in (None, "tutti") else stato):
+            voce = sorgente.tariffario.get(riga[1])
+            riga[1:2] = [voce['codice'], voce['descrizione']] if voce else [riga[1], "(non presente nel tariffario)"]
+            righe.append([sorgente.nome] + riga)
+    return righe
+
+
+def aggiorna_alias(codice, codice_tariffario, stato, filtro):
+    """Conferma o rifiuta l'alias codice -> codice_tariffario e aggiorna l'elenco."""
+    if not tariffario_pronto():
+        return [], "Tariffario in caricamento, riprova tra qualche istante."
+    if not codice or not codice.strip() or not codice_tariffario or not codice_tariffario.strip():
+        return elenco_alias_tariffario(filtro), "Inserisci il codice e la voce del tariffario."
+    chiave = pulisci_codice(codice_tariffario)
+    # La voce appartiene al prezziario della sua regione, se il prefisso ne indica una,
+    # altrimenti al tariffario principale o a uno dei prezziari regionali in memoria
+    sorgenti = _sorgenti_alias()
+    if INDICE_NAZIONALE:
+        sorgenti = list(get_indice_nazionale().shard_per_codici([chiave]).values()) + sorgenti
+    sorgente = next((s for s in sorgenti if s.chiave(chiave) in s.tariffario), None)
+    if sorgente is None:
+        return elenco_alias_tariffario(filtro), f"{codice_tariffario} non e' presente nel tariffario."
+    chiave = sorgente.chiave(chiave)
+    get_archivio().imposta_stato_alias(sorgente.tariffario_id, codice, chiave, stato)
+    voce = sorgente.tariffario[chiave]
+    return elenco_alias_tariffario(filtro), f"Alias {normalizza_codice(codice)} -> {voce['codice']}: {stato}"
+
+
+COLONNE_RISULTATI = ["Codice", "Descrizione", "Unità", "Prezzo Unitario", "Quantità", "Costo Totale"]
+
+
+def crea_interfaccia():
+    """Costruisce l'interfaccia Gradio (confronto, archivio e gestione degli alias)."""
+    import gradio as gr
+
+    confronto = gr.Interface(
+        fn=confronta_pdf_csv,
+        api_name="confronta_pdf_csv",
+        inputs=[
+            gr.File(label="Carica PDF (computo metrico)", file_types=[".pdf"]),
+        ],
+        outputs=[
+            gr.Dataframe(
+                headers=COLONNE_RISULTATI,
+                label="Risultati confronto",
+            ),
+            gr.Textbox(label="Output in linea", lines=10),
+            gr.Textbox(label="Log", lines=2),
+            gr.File(label="File esportati", file_count="multiple"),
+        ],
+        title=f"Confronto PDF ↔ {TARIFFARIO_NAME}",
+        description=(
+            f"Carica un computo metrico in PDF. "
+            f"Il tariffario '{TARIFFARIO_NAME}' è precaricato all'avvio. "
+            f"Il sistema estrae i codici dal PDF, li confronta (tramite xcode pulito) "
+            f"con il tariffario e restituisce: codice, descrizione, unità, prezzo unitario, quantità e costo totale."
+        ),
+    )
+
+    with gr.Blocks() as archivio:
+        gr.Markdown("Consultazione dei documenti già elaborati. Le risposte arrivano dall'archivio locale, senza chiamate a Claude.")
+        with gr.Row():
+            codice_input = gr.Textbox(label="Codice")
+            dal_input = gr.Textbox(label="Dal (AAAA-MM-GG)")
+            al_input = gr.Textbox(label="Al (AAAA-MM-GG)")
+        cerca_btn = gr.Button("Cerca codice")
+        storico_output = gr.Dataframe(
+            headers=["Data", "Documento", "Codice", "Descrizione", "Unità", "Prezzo", "Quantità", "Costo Totale"],
+            label="Storico prezzi",
+        )
+        storico_log = gr.Textbox(label="Esito", lines=1)
+        cerca_btn.click(cerca_in_archivio, [codice_input, dal_input, al_input], [storico_output, storico_log])
+
+        with gr.Row():
+            nome_input = gr.Textbox(label="Nome documento")
+            elenco_btn = gr.Button("Elenca documenti")
+        elenco_output = gr.Dataframe(
+            headers=["Id", "Data", "Documento", "Hash", "Tariffario", "Voci"],
+            label="Documenti archiviati",
+        )
+        elenco_btn.click(elenco_archivio, [nome_input], [elenco_output])
+
+        with gr.Row():
+            id_input = gr.Number(label="Id documento", precision=0)
+            mostra_btn = gr.Button("Mostra documento")
+        documento_output = gr.Dataframe(headers=COLONNE_RISULTATI, label="Risultati archiviati")
+        documento_testo = gr.Textbox(label="Output in linea", lines=10)
+        documento_log = gr.Textbox(label="Log", lines=2)
+        mostra_btn.click(mostra_documento_archiviato, [id_input], [documento_output, documento_testo, documento_log])
+
+    with gr.Blocks() as alias:
+        gr.Markdown(
+            "Alias appresi tra i documenti: codici letti dal PDF risolti a una voce del tariffario "
+            "tramite match approssimato o analisi di Claude. Gli alias proposti vengono già usati "
+            "e segnalati come approssimati; quelli confermati valgono come match esatti, quelli rifiutati "
+            "non vengono più applicati."
+        )
+        with gr.Row():
+            stato_input = gr.Dropdown(STATI_ALIAS, value="proposto", label="Stato")
+            elenco_alias_btn = gr.Button("Elenca alias")
+        alias_output = gr.Dataframe(
+            headers=["Tariffario", "Codice", "Voce tariffario", "Descrizione", "Origine", "Stato", "Occorrenze", "Aggiornato il"],
+            label="Alias",
+        )
+        with gr.Row():
+            alias_codice_input = gr.Textbox(label="Codice")
+            alias_voce_input = gr.Textbox(label="Voce tariffario")
+            conferma_btn = gr.Button("Conferma")
+            rifiuta_btn = gr.Button("Rifiuta")
+        alias_log = gr.Textbox(label="Esito", lines=1)
+        elenco_alias_btn.click(elenco_alias_tariffario, [stato_input], [alias_output])
+        conferma_btn.click(
+            lambda c, v, f: aggiorna_alias(c, v, ALIAS_CONFERMATO, f),
+            [alias_codice_input, alias_voce_input, stato_input], [alias_output, alias_log],
+        )
+        rifiuta_btn.click(
+            lambda c, v, f: aggiorna_alias(c, v, ALIAS_RIFIUTATO, f),
+            [alias_codice_input, alias_voce_input, stato_input], [alias_output, alias_log],
+        )
+
+    return gr.TabbedInterface([confronto, archivio, alias], ["Confronto", "Archivio", "Alias"])
 
 
-demo = gr.Interface(
-    fn=confronta_pdf_csv,
-    inputs=[
-        gr.File(label="Carica PDF (computo metrico)", file_types=[".pdf"]),
-    ],
-    outputs=[
-        gr.Dataframe(
-            headers=["Codice", "Descrizione", "Unità", "Prezzo Unitario", "Quantità", "Costo Totale"],
-            label="Risultati confronto",
-        ),
-        gr.Textbox(label="Output in linea", lines=10),
-        gr.Textbox(label="Log", lines=2),
-    ],
-    title=f"Confronto PDF ↔ {TARIFFARIO_NAME}",
-    description=(
-        f"Carica un computo metrico in PDF. "
-        f"Il tariffario '{TARIFFARIO_NAME}' è precaricato ({len(TARIFFARIO)} voci). "
-        f"Il sistema estrae i codici dal PDF, li confronta (tramite xcode pulito) "
-        f"con il tariffario e restituisce: codice, descrizione, unità, prezzo unitario, quantità e costo totale."
-    ),
-)
+def crea_app():
+    """
+    Applicazione FastAPI con l'interfaccia Gradio montata su / e gli endpoint per il load balancer:
+    /healthz (liveness) e /readyz (readiness, 200 solo a tariffario caricato).
+    """
+    import gradio as gr
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+
+    server = FastAPI()
+
+    @server.get("/healthz")
+    def healthz():
+        if ERRORE_CARICAMENTO is not None:
+            return JSONResponse({"stato": "errore", "errore": str(ERRORE_CARICAMENTO)}, status_code=500)
+        return {"stato": "attivo"}
+
+    @server.get("/readyz")
+    def readyz():
+        if not tariffario_pronto():
+            return JSONResponse({"stato": "in caricamento"}, status_code=503)
+        return {"stato": "pronto", "voci": len(TARIFFARIO)}
+
+    interfaccia = crea_interfaccia()
+    # Documenti elaborati in parallelo da un'istanza (il default di Gradio e' 1)
+    interfaccia.queue(default_concurrency_limit=GRADIO_CONCORRENZA)
+    return gr.mount_gradio_app(server, interfaccia, path="/")
+
 
 if __name__ == "__main__":
-    demo.launch()
+    import uvicorn
+
+    avvia_caricamento_tariffario()
+    uvicorn.run(
+        crea_app(),
+        host=os.environ.get("GRADIO_SERVER_NAME", "127.0.0.1"),
+        port=int(os.environ.get("GRADIO_SERVER_PORT", "7860")),
+    )
@@ -0,0 +1,98 @@
+"""
+Benchmark di avvio dell'applicazione.
+
+Misura, in processi separati:
+1. il tempo di `import app` (e dei moduli pesanti, per confronto);
+2. il tempo dall'avvio di `python app.py` alla prima risposta di /healthz (UI raggiungibile);
+3. il tempo fino a /readyz = 200 (tariffario e indici caricati).
+
+Uso:
+    python -m benchmark.avvio [--ripetizioni 5] [--porta 7861]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tempo_import(modulo: str) -> float:
+    """Secondi necessari a importare `modulo` in un interprete nuovo."""
+    codice = (
+        "import time; t = time.perf_counter(); "
+        f"import {modulo}; "
+        "print(time.perf_counter() - t)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", codice], cwd=DIR, capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _stato(url: str) -> int | None:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as risposta:
+            return risposta.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None
+
+
+def tempo_servizio(porta: int, timeout: float = 300) -> tuple[float, float]:
+    """Avvia app.py e misura i secondi fino a /healthz raggiungibile e fino a /readyz = 200."""
+    env = dict(os.environ, GRADIO_SERVER_PORT=str(porta))
+    inizio = time.perf_counter()
+    processo = subprocess.Popen(
+        [sys.executable, "app.py"], cwd=DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    vivo = pronto = None
+    try:
+        while time.perf_counter() - inizio < timeout:
+            if processo.poll() is not None:
+                raise RuntimeError(f"app.py terminata con codice {processo.returncode}")
+            if vivo is None and _stato(f"http://127.0.0.1:{porta}/healthz") == 200:
+                vivo = time.perf_counter() - inizio
+            if vivo is not None and _stato(f"http://127.0.0.1:{porta}/readyz") == 200:
+                pronto = time.perf_counter() - inizio
+                break
+            time.sleep(0.05)
+    finally:
+        processo.terminate()
+        processo.wait()
+    if pronto is None:
+        raise TimeoutError(f"Servizio non pronto entro {timeout}s")
+    return vivo, pronto
+
+
+def _riepilogo(valori):
+    return f"mediana {statistics.median(valori):.3f}s | min {min(valori):.3f}s | max {max(valori):.3f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--porta", type=int, default=7861)
+    parser.add_argument("--senza-servizio", action="store_true", help="misura solo i tempi di import")
+    args = parser.parse_args()
+
+    for modulo in ["app", "gradio", "anthropic", "fitz", "PIL.Image"]:
+        tempi = [tempo_import(modulo) for _ in range(args.ripetizioni)]
+        print(f"import {modulo:<10} {_riepilogo(tempi)}")
+
+    if args.senza_servizio:
+        return
+
+    misure = [tempo_servizio(args.porta) for _ in range(args.ripetizioni)]
+    print(f"healthz          {_riepilogo([m[0] for m in misure])}")
+    print(f"readyz           {_riepilogo([m[1] for m in misure])}")
+
+
+if __name__ == "__main__":
+    main()
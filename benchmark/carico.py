@@ -0,0 +1,250 @@
+"""
+Test di carico: quanti documenti contemporanei regge un'istanza di app.py.
+
+Avvia un server Anthropic finto (benchmark.fake_anthropic) con latenza ed errori
+configurabili e app.py come processo separato puntato su di esso, poi invia N sessioni
+concorrenti di confronta_pdf_csv tramite l'API client di Gradio, su un corpus di PDF
+sintetici. Per ogni livello di concorrenza riporta throughput, latenza per documento
+(p50/p95/p99) e il tempo medio di ogni fase letto dal log finale ("Tempi: ...");
+l'attesa in coda e' la differenza tra la latenza vista dal client e il totale lato server.
+La fase il cui tempo medio cresce di piu' tra il primo e l'ultimo livello e' quella che
+satura per prima.
+
+Uso:
+    python -m benchmark.carico [--concorrenza 1,2,4,8] [--documenti 16] [--pagine 6]
+                               [--latenza 1.0] [--errori 0.02] [--gradio-concorrenza 4]
+"""
+import os
+import re
+import sys
+import time
+import random
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR)
+
+from benchmark.avvio import _stato
+from benchmark.fake_anthropic import StatoFake, avvia
+
+RE_TEMPI = re.compile(r'Tempi: (.*)$')
+RE_FASE = re.compile(r'([^,]+?) ([\d.]+)s')
+
+ATTESA_CODA = "attesa in coda"
+
+
+def porta_libera() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def genera_tariffario(path: str, voci: int = 2000) -> list[str]:
+    """Tariffario CSV sintetico nel formato atteso da carica_tariffario_csv."""
+    codici = [f"CAM25_MT.L11.{i // 100:03d}.{i % 100:03d}" for i in range(voci)]
+    rng = random.Random(0)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Codice;Descrizione;UM;Prezzo\n")
+        for codice in codici:
+            prezzo = f"{rng.uniform(1, 100):.2f}".replace(".", ",")
+            f.write(f"{codice};Fornitura e posa {codice};m;{prezzo}\n")
+    return codici
+
+
+def genera_corpus(cartella: str, documenti: int, pagine: int, codici: list[str]) -> list[str]:
+    """PDF sintetici con tabelle di codici nel text layer; contenuti diversi per evitare la cache dell'archivio."""
+    import fitz
+
+    rng = random.Random(1)
+    percorsi = []
+    for d in range(documenti):
+        doc = fitz.open()
+        for p in range(pagine):
+            pagina = doc.new_page(width=595, height=842)
+            pagina.insert_text((40, 40), f"COMPUTO METRICO - documento {d + 1} pagina {p + 1}", fontsize=12)
+            for k in range(20):
+                y = 80 + k * 30
+                pagina.draw_line((40, y + 8), (555, y + 8))
+                pagina.insert_text(
+                    (40, y), f"{rng.choice(codici)}   Fornitura e posa   m   {rng.randint(1, 500)},00", fontsize=9
+                )
+        percorso = os.path.join(cartella, f"computo_{d + 1:03d}.pdf")
+        doc.save(percorso, garbage=4, deflate=True)
+        doc.close()
+        percorsi.append(percorso)
+    return percorsi
+
+
+def avvia_app(porta: int, porta_fake: int, cartella: str, tariffario: str, args) -> subprocess.Popen:
+    """Avvia app.py puntata sul server finto e attende /readyz."""
+    env = dict(
+        os.environ,
+        ANTHROPIC_BASE_URL=f"http://127.0.0.1:{porta_fake}",
+        ANTHROPIC_API_KEY="fake",
+        TARIFFARIO_PATH=tariffario,
+        ARCHIVIO_PATH=os.path.join(cartella, "archivio.sqlite3"),
+        ARCHIVIO_RIUSA="0",
+        # Nessun file di export: le sessioni non devono riempire output/ del repository
+        EXPORT_FORMATI="",
+        GRADIO_SERVER_PORT=str(porta),
+        GRADIO_CONCORRENZA=str(args.gradio_concorrenza),
+        CLAUDE_RICHIESTE_MINUTO=str(args.richieste_minuto),
+        CLAUDE_TOKEN_MINUTO=str(args.token_minuto),
+        CLAUDE_PAUSA_CIRCUITO="5",
+    )
+    if args.solo_accurato:
+        env["MODELLO_VELOCE"] = ""
+    processo = subprocess.Popen(
+        [sys.executable, "app.py"], cwd=DIR, env=env,
+        stdout=open(os.path.join(cartella, "app.log"), "w"), stderr=subprocess.STDOUT,
+    )
+    inizio = time.perf_counter()
+    while time.perf_counter() - inizio < 300:
+        if processo.poll() is not None:
+            raise RuntimeError(f"app.py terminata con codice {processo.returncode} (log in {cartella}/app.log)")
+        if _stato(f"http://127.0.0.1:{porta}/readyz") == 200:
+            return processo
+        time.sleep(0.2)
+    processo.terminate()
+    raise TimeoutError("app.py non e' diventata pronta entro 300 secondi")
+
+
+def fasi_da_log(log_finale: str) -> dict:
+    """Tempi per fase dal suffisso 'Tempi: fase 1.23s, ...' del log finale."""
+    trovato = RE_TEMPI.search(log_finale or "")
+    if not trovato:
+        return {}
+    return {fase.strip(): float(secondi) for fase, secondi in RE_FASE.findall(trovato.group(1))}
+
+
+def sessione(url: str, percorso: str) -> dict:
+    """Una sessione utente: carica il PDF e attende il risultato del confronto."""
+    from gradio_client import Client, handle_file
+
+    client = Client(url, verbose=False)
+    inizio = time.perf_counter()
+    try:
+        _, _, log_finale, _ = client.predict(handle_file(percorso), api_name="/confronta_pdf_csv")
+    except Exception as e:
+        return {"latenza": time.perf_counter() - inizio, "errore": str(e) or type(e).__name__, "fasi": {}}
+    latenza = time.perf_counter() - inizio
+    fasi = fasi_da_log(log_finale)
+    if "totale" in fasi:
+        fasi[ATTESA_CODA] = max(0.0, latenza - fasi["totale"])
+    errore = None if fasi else (log_finale or "risposta vuota")
+    return {"latenza": latenza, "errore": errore, "fasi": fasi}
+
+
+def percentile(valori: list[float], p: float) -> float:
+    ordinati = sorted(valori)
+    k = (len(ordinati) - 1) * p / 100
+    basso = int(k)
+    alto = min(basso + 1, len(ordinati) - 1)
+    return ordinati[basso] + (ordinati[alto] - ordinati[basso]) * (k - basso)
+
+
+def esegui_livello(url: str, corpus: list[str], concorrenza: int, documenti: int) -> dict:
+    """Invia `documenti` sessioni con al massimo `concorrenza` in volo contemporaneamente."""
+    lavori = [corpus[i % len(corpus)] for i in range(documenti)]
+    inizio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrenza) as pool:
+        esiti = list(pool.map(lambda percorso: sessione(url, percorso), lavori))
+    durata = time.perf_counter() - inizio
+
+    riusciti = [e for e in esiti if not e["errore"]]
+    latenze = [e["latenza"] for e in riusciti]
+    fasi = {}
+    for esito in riusciti:
+        for fase, secondi in esito["fasi"].items():
+            fasi.setdefault(fase, []).append(secondi)
+    return {
+        "concorrenza": concorrenza,
+        "documenti": len(esiti),
+        "errori": [e["errore"] for e in esiti if e["errore"]],
+        "throughput": len(riusciti) / durata * 60,
+        "p50": percentile(latenze, 50) if latenze else float("nan"),
+        "p95": percentile(latenze, 95) if latenze else float("nan"),
+        "p99": percentile(latenze, 99) if latenze else float("nan"),
+        "fasi": {fase: statistics.mean(valori) for fase, valori in fasi.items()},
+    }
+
+
+def stampa_report(livelli: list[dict], stato_fake: StatoFake):
+    fasi = [f for f in livelli[0]["fasi"] if f != "totale"]
+    print()
+    print(f"{'conc':>4} {'doc':>4} {'err':>4} {'doc/min':>8} {'p50':>7} {'p95':>7} {'p99':>7}  "
+          + " ".join(f"{f[:10]:>10}" for f in fasi))
+    for l in livelli:
+        print(
+            f"{l['concorrenza']:>4} {l['documenti']:>4} {len(l['errori']):>4} {l['throughput']:>8.1f} "
+            f"{l['p50']:>6.1f}s {l['p95']:>6.1f}s {l['p99']:>6.1f}s  "
+            + " ".join(f"{l['fasi'].get(f, float('nan')):>9.2f}s" for f in fasi)
+        )
+    for l in livelli:
+        for errore in sorted(set(l["errori"]))[:3]:
+            print(f"  errore (concorrenza {l['concorrenza']}): {errore[:200]}")
+
+    stats = stato_fake.stats()
+    print(f"\nServer finto: {stats['richieste']} richieste, {stats['errori_iniettati']} errori iniettati, "
+          f"massimo {stats['max_in_corso']} richieste contemporanee")
+
+    if len(livelli) > 1 and fasi:
+        primo, ultimo = livelli[0]["fasi"], livelli[-1]["fasi"]
+        crescita = {f: ultimo.get(f, 0.0) - primo.get(f, 0.0) for f in fasi}
+        satura = max(crescita, key=crescita.get)
+        print(
+            f"Fase che satura per prima: {satura} "
+            f"({primo.get(satura, 0.0):.2f}s -> {ultimo.get(satura, 0.0):.2f}s per documento "
+            f"da concorrenza {livelli[0]['concorrenza']} a {livelli[-1]['concorrenza']})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concorrenza", default="1,2,4,8", help="livelli di sessioni contemporanee")
+    parser.add_argument("--documenti", type=int, default=16, help="documenti inviati per livello")
+    parser.add_argument("--corpus", type=int, default=8, help="PDF sintetici distinti")
+    parser.add_argument("--pagine", type=int, default=6, help="pagine per PDF")
+    parser.add_argument("--latenza", type=float, default=1.0, help="latenza media del server finto in secondi")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--errori", type=float, default=0.0, help="probabilita' di risposta 429/529")
+    parser.add_argument("--gradio-concorrenza", type=int, default=4, help="GRADIO_CONCORRENZA dell'app")
+    parser.add_argument("--richieste-minuto", type=float, default=1000, help="CLAUDE_RICHIESTE_MINUTO dell'app")
+    parser.add_argument("--token-minuto", type=float, default=10_000_000, help="CLAUDE_TOKEN_MINUTO dell'app")
+    parser.add_argument("--solo-accurato", action="store_true", help="disattiva la cascata (MODELLO_VELOCE vuoto)")
+    args = parser.parse_args()
+    livelli_concorrenza = [int(c) for c in args.concorrenza.split(",")]
+
+    with tempfile.TemporaryDirectory() as cartella:
+        tariffario = os.path.join(cartella, "tariffario.csv")
+        codici = genera_tariffario(tariffario)
+        print(f"Generazione corpus: {args.corpus} PDF da {args.pagine} pagine...")
+        corpus = genera_corpus(cartella, args.corpus, args.pagine, codici)
+
+        porta_fake, porta_app = porta_libera(), porta_libera()
+        stato_fake = StatoFake(codici, args.latenza, args.jitter, args.errori)
+        server_fake = avvia(stato_fake, porta_fake)
+        print(f"Server finto su :{porta_fake} (latenza {args.latenza}s, errori {args.errori:.0%})")
+
+        processo = avvia_app(porta_app, porta_fake, cartella, tariffario, args)
+        url = f"http://127.0.0.1:{porta_app}/"
+        print(f"app.py pronta su :{porta_app} (GRADIO_CONCORRENZA={args.gradio_concorrenza})")
+        try:
+            livelli = []
+            for concorrenza in livelli_concorrenza:
+                print(f"Concorrenza {concorrenza}: {args.documenti} documenti...")
+                livelli.append(esegui_livello(url, corpus, concorrenza, args.documenti))
+            stampa_report(livelli, stato_fake)
+        finally:
+            processo.terminate()
+            processo.wait(timeout=30)
+            server_fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Server locale che imita l'endpoint /v1/messages di Anthropic per i test di carico.
+
+Non legge le immagini: per ogni marcatore "--- PAGINA N ---" della richiesta restituisce
+alcune voci estratte a caso dal tariffario indicato, nel formato atteso dal prompt.
+La latenza e gli errori (429 e 529) sono configurabili; GET /stats restituisce il numero
+di richieste servite e il massimo di richieste contemporanee osservato.
+
+Uso:
+    python -m benchmark.fake_anthropic --tariffario Tariffario.csv --porta 8765 --latenza 1.5 --errori 0.05
+"""
+import re
+import csv
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RE_PAGINA = re.compile(r'PAGINA\s+(\d+)')
+
+
+class StatoFake:
+    """Configurazione e contatori condivisi tra i thread del server."""
+
+    def __init__(self, codici, latenza=1.0, jitter=0.3, errori=0.0, voci_per_pagina=8, limite_minuto=100000):
+        self.codici = codici
+        self.latenza = latenza
+        self.jitter = jitter
+        self.errori = errori
+        self.voci_per_pagina = voci_per_pagina
+        self.limite_minuto = limite_minuto
+        self.lock = threading.Lock()
+        self.in_corso = 0
+        self.max_in_corso = 0
+        self.richieste = 0
+        self.errori_iniettati = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "richieste": self.richieste,
+                "errori_iniettati": self.errori_iniettati,
+                "in_corso": self.in_corso,
+                "max_in_corso": self.max_in_corso,
+            }
+
+
+def _risposta_estrazione(stato, corpo):
+    """Voci casuali del tariffario per ogni pagina della richiesta."""
+    pagine = []
+    for messaggio in corpo.get("messages", []):
+        contenuto = messaggio.get("content", "")
+        blocchi = contenuto if isinstance(contenuto, list) else [{"type": "text", "text": contenuto}]
+        for blocco in blocchi:
+            if blocco.get("type") == "text":
+                pagine.extend(int(n) for n in RE_PAGINA.findall(blocco["text"]))
+    rng = random.Random(sum(pagine) or 1)
+    parti = []
+    for pagina in pagine or [1]:
+        voci = [(rng.choice(stato.codici), float(rng.randint(1, 500))) for _ in range(stato.voci_per_pagina)]
+        parti.append(f"PAGINA {pagina}:\n```python\n{voci!r}\n```")
+    return "\n".join(parti)
+
+
+def crea_handler(stato):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, codice, dati, headers=None):
+            corpo = json.dumps(dati).encode("utf-8")
+            self.send_response(codice)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(corpo)))
+            for nome, valore in (headers or {}).items():
+                self.send_header(nome, valore)
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._json(200, stato.stats())
+            else:
+                self._json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+        def do_POST(self):
+            lunghezza = int(self.headers.get("content-length", 0))
+            corpo = json.loads(self.rfile.read(lunghezza) or b"{}")
+            with stato.lock:
+                stato.richieste += 1
+                stato.in_corso += 1
+                stato.max_in_corso = max(stato.max_in_corso, stato.in_corso)
+            try:
+                time.sleep(max(0.0, random.gauss(stato.latenza, stato.jitter)))
+                headers = {
+                    "anthropic-ratelimit-requests-limit": str(stato.limite_minuto),
+                    "anthropic-ratelimit-requests-remaining": str(stato.limite_minuto),
+                }
+
+                if random.random() < stato.errori:
+                    with stato.lock:
+                        stato.errori_iniettati += 1
+                    if random.random() < 0.5:
+                        self._json(429, {"type": "error", "error": {"type": "rate_limit_error", "message": "fake"}},
+                                   {**headers, "retry-after": "1"})
+                    else:
+                        self._json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "fake"}},
+                                   headers)
+                    return
+
+                if "analizzatore" in str(corpo.get("system", "")):
+                    # Analisi finale: risposta vuota, l'applicazione mantiene i risultati originali
+                    testo = '{"risultati": [], "non_trovati": []}'
+                else:
+                    testo = _risposta_estrazione(stato, corpo)
+                self._json(200, {
+                    "id": f"msg_fake_{stato.richieste}",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": corpo.get("model", "fake"),
+                    "content": [{"type": "text", "text": testo}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": 1600 * max(1, len(RE_PAGINA.findall(json.dumps(corpo)))),
+                              "output_tokens": len(testo) // 4},
+                }, headers)
+            finally:
+                with stato.lock:
+                    stato.in_corso -= 1
+
+    return Handler
+
+
+def carica_codici(path_tariffario):
+    """Codici del tariffario CSV (prima colonna il cui nome contiene 'cod')."""
+    with open(path_tariffario, encoding="utf-8-sig") as f:
+        dialect = csv.Sniffer().sniff(f.read(8192))
+        f.seek(0)
+        reader = csv.DictReader(f, dialect=dialect)
+        colonna = next(c for c in reader.fieldnames if "cod" in c.lower())
+        return [riga[colonna].strip() for riga in reader if riga[colonna].strip()]
+
+
+def avvia(stato, porta):
+    """Avvia il server in un thread daemon e lo restituisce."""
+    server = ThreadingHTTPServer(("127.0.0.1", porta), crea_handler(stato))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-anthropic", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tariffario", required=True)
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--latenza", type=float, default=1.0, help="latenza media in secondi")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--errori", type=float, default=0.0, help="probabilita' di risposta 429/529")
+    args = parser.parse_args()
+
+    stato = StatoFake(carica_codici(args.tariffario), args.latenza, args.jitter, args.errori)
+    server = ThreadingHTTPServer(("127.0.0.1", args.porta), crea_handler(stato))
+    server.daemon_threads = True
+    print(f"Fake Anthropic in ascolto su http://127.0.0.1:{args.porta}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
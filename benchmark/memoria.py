@@ -0,0 +1,118 @@
+"""
+Verifica del picco di memoria su un PDF sintetico molto grande.
+
+Genera un PDF di N pagine (default 1000) con tabelle di codici, lo elabora con
+estrai_codici_da_pdf sostituendo Claude con un client locale che legge il testo
+della pagina, e controlla che il picco di RSS del processo resti entro il budget
+MEMORIA_MAX_MB piu' la memoria occupata dopo gli import. Esce con codice 1 se il
+limite viene superato.
+
+Uso:
+    python -m benchmark.memoria [--pagine 1000] [--memoria-mb 256]
+"""
+import os
+import re
+import sys
+import time
+import types
+import argparse
+import resource
+import tempfile
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIR)
+
+
+def rss_picco_mb() -> float:
+    """Picco di RSS del processo corrente in MB (ru_maxrss e' in KB su Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def genera_pdf(path: str, pagine: int, voci_per_pagina: int = 25):
+    """PDF sintetico: ogni pagina contiene una tabella di codici con quantita'."""
+    import fitz
+
+    doc = fitz.open()
+    for p in range(pagine):
+        pagina = doc.new_page(width=595, height=842)
+        pagina.insert_text((40, 40), f"COMPUTO METRICO ESTIMATIVO - pagina {p + 1}", fontsize=12)
+        for k in range(voci_per_pagina):
+            y = 80 + k * 28
+            pagina.draw_line((40, y + 8), (555, y + 8))
+            pagina.insert_text(
+                (40, y), f"CAM25_MT.L11.{p % 1000:03d}.{k:03d}   Fornitura e posa   m   {k + 1},00", fontsize=9
+            )
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+class ClientLocale:
+    """Sostituto di ClientClaudeResiliente: risponde con le voci lette dal testo della pagina."""
+
+    def __init__(self, pdf_path):
+        import fitz
+
+        self._doc = fitz.open(pdf_path)
+        self.chiamate = 0
+
+    def crea_messaggio(self, **kwargs):
+        self.chiamate += 1
+        testo = " ".join(
+            b["text"] for b in kwargs["messages"][0]["content"] if b.get("type") == "text"
+        )
+        pagina = int(re.search(r"PAGINA (\d+)", testo).group(1))
+        voci = [
+            (m.group(1), float(m.group(2)))
+            for m in re.finditer(r"(\S+)\s+Fornitura e posa\s+m\s+(\d+),00", self._doc[pagina - 1].get_text())
+        ]
+        return types.SimpleNamespace(content=[types.SimpleNamespace(text=f"```python\n{voci!r}\n```")])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pagine", type=int, default=1000)
+    parser.add_argument("--memoria-mb", type=int, default=256)
+    parser.add_argument("--dpi", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["MEMORIA_MAX_MB"] = str(args.memoria_mb)
+    # Senza tariffario la verifica di confidenza scalerebbe ogni pagina: si misura il solo modello accurato
+    os.environ["MODELLO_VELOCE"] = ""
+
+    with tempfile.TemporaryDirectory() as cartella:
+        pdf_path = os.path.join(cartella, "sintetico.pdf")
+        print(f"Generazione PDF sintetico di {args.pagine} pagine...")
+        genera_pdf(pdf_path, args.pagine)
+
+        # L'elaborazione avviene in un processo figlio, cosi' il picco non include la generazione del PDF
+        pid = os.fork()
+        if pid == 0:
+            import app
+            from service.raccolta import RaccoltaRisposte
+
+            client = ClientLocale(pdf_path)
+            app.get_client = lambda: client
+            app.log = lambda msg: None
+            base = rss_picco_mb()
+
+            inizio = time.perf_counter()
+            with RaccoltaRisposte(max_memoria=args.memoria_mb * 1024 * 1024 // 8) as raccolta:
+                lista, log_str = app.estrai_codici_da_pdf(pdf_path, dpi=args.dpi, on_pagina=raccolta.aggiungi)
+                su_disco = raccolta.su_disco
+            durata = time.perf_counter() - inizio
+
+            picco = rss_picco_mb()
+            limite = base + args.memoria_mb
+            print(log_str)
+            print(f"Chiamate: {client.chiamate} | durata {durata:.1f}s | risposte su disco: {su_disco}")
+            print(f"RSS dopo gli import: {base:.0f} MB | picco: {picco:.0f} MB | limite: {limite:.0f} MB")
+            os._exit(0 if picco <= limite and len(lista) > 0 else 1)
+
+        _, stato = os.waitpid(pid, 0)
+        codice = os.waitstatus_to_exitcode(stato)
+        print("OK" if codice == 0 else "FALLITO: picco di memoria oltre il budget")
+        sys.exit(codice)
+
+
+if __name__ == "__main__":
+    main()
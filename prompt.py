@@ -1,6 +1,6 @@
-PROMPT = """Sei un estrattore di dati da computi metrici estimativi in formato PDF.
+_ISTRUZIONI_ESTRAZIONE = """Sei un estrattore di dati da computi metrici estimativi in formato PDF.
 
-OBIETTIVO: Estrarre tutti i codici dei Tariffari Regionali Edili e le relative quantità totali presenti nella pagina fornita.
+OBIETTIVO: Estrarre tutti i codici dei Tariffari Regionali Edili e le relative quantità totali presenti {ambito}.
 
 REGOLE DI ESTRAZIONE:
 1. I codici tariffario si trovano nella colonna di sinistra della tabella.
@@ -15,7 +15,10 @@ REGOLE CRITICHE PER I CODICI:
 8. I prefissi regionali tipici sono: ABR25, CAL25, CAM25, TOS25, ecc. seguiti da underscore (_).
 9. Se un codice non è leggibile chiaramente, riporta comunque la tua miglior lettura.
 10. NON inventare o modificare codici: trascrivi solo ciò che vedi.
+"""
+
 
+PROMPT = _ISTRUZIONI_ESTRAZIONE.format(ambito="nella pagina fornita") + """
 FORMATO OUTPUT — rispondi ESCLUSIVAMENTE con una lista Python di tuple, senza testo aggiuntivo:
 
 ```python
@@ -29,6 +32,30 @@ Esempio:
 """
 
 
+PROMPT_MULTIPAGINA = _ISTRUZIONI_ESTRAZIONE.format(ambito="in ciascuna delle pagine fornite") + """
+PIU' PAGINE NELLA STESSA RICHIESTA:
+Riceverai piu' pagine, ognuna preceduta dal marcatore "--- PAGINA N ---".
+Estrai i codici di ciascuna pagina separatamente, senza accorpare voci di pagine diverse.
+
+FORMATO OUTPUT — per OGNI pagina ricevuta rispondi con la riga "PAGINA N:" (stesso numero
+del marcatore) seguita da una lista Python di tuple, senza altro testo aggiuntivo.
+Se una pagina non contiene codici, riporta comunque "PAGINA N:" seguita da una lista vuota.
+
+Esempio con le pagine 3, 4 e 5:
+PAGINA 3:
+```python
+[("CAM25_29.392.038", 400.00)]
+```
+PAGINA 4:
+```python
+[("CAM25_83.293.001.a", 250.00), ("CAM25_83.293.002", 12.00)]
+```
+PAGINA 5:
+```python
+[]
+```
+"""
+
 SYSTEM_ANALISI_FINALE = "Sei un analizzatore di dati di computi metrici. Rispondi SOLO con il JSON richiesto, senza testo aggiuntivo."
 
 formato_json="""```json
@@ -37,7 +64,8 @@ formato_json="""```json
     ["codice", "descrizione", "unità", prezzo, quantità, costo_totale],
     ...
   ],
-  "non_trovati": ["codice1", "codice2", ...]
+  "non_trovati": ["codice1", "codice2", ...],
+  "risolti": {{"codice_non_trovato": "codice_tariffario", ...}}
 }}
 ```"""
 
@@ -64,7 +92,7 @@ VOCI TARIFFARIO DISPONIBILI PER I CODICI NON TROVATI:
 
 ISTRUZIONI:
 1. DOPPIONI: Se trovi codici duplicati (stesso codice che appare più volte), tieni SOLO quello con la quantità più alta e rimuovi gli altri.
-2. VOCI MANCANTI: Per ogni codice nella lista "NON TROVATI", cerca tra le "VOCI TARIFFARIO DISPONIBILI" la corrispondenza più probabile (potrebbe differire per un carattere, punto vs underscore, lettera maiuscola/minuscola, ecc.). Se trovi una corrispondenza, aggiungilo ai risultati copiando descrizione, unità e prezzo dal tariffario e usando la quantità indicata nel codice non trovato. Se non trovi corrispondenza, lascialo come non trovato.
+2. VOCI MANCANTI: Per ogni codice nella lista "NON TROVATI", cerca tra le "VOCI TARIFFARIO DISPONIBILI" la corrispondenza più probabile (potrebbe differire per un carattere, punto vs underscore, lettera maiuscola/minuscola, ecc.). Se trovi una corrispondenza, aggiungilo ai risultati copiando descrizione, unità e prezzo dal tariffario e usando la quantità indicata nel codice non trovato. Se non trovi corrispondenza, lascialo come non trovato. Per ogni codice recuperato riporta in "risolti" il codice non trovato originale e il codice del tariffario scelto.
 3. NON MODIFICARE le voci già correttamente inserite nei risultati (non cambiare quantità, descrizione o prezzo delle voci esistenti).
 
 FORMATO OUTPUT — rispondi ESCLUSIVAMENTE con un JSON valido, senza testo aggiuntivo prima o dopo:
@@ -0,0 +1,354 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from service.service_main import OUTPUT_DIR, normalizza_codice
+
+PATH_ARCHIVIO = os.path.join(OUTPUT_DIR, "archivio.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tariffari (
+    id INTEGER PRIMARY KEY,
+    nome TEXT NOT NULL,
+    hash TEXT NOT NULL UNIQUE,
+    voci INTEGER NOT NULL,
+    caricato_il TEXT NOT NULL,
+    revisione_alias INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS documenti (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    nome TEXT NOT NULL,
+    tariffario_id INTEGER NOT NULL REFERENCES tariffari(id),
+    elaborato_il TEXT NOT NULL,
+    log TEXT,
+    output TEXT,
+    completo INTEGER NOT NULL DEFAULT 0,
+    fonti TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_documenti_hash ON documenti(hash);
+CREATE INDEX IF NOT EXISTS idx_documenti_data ON documenti(elaborato_il);
+
+CREATE TABLE IF NOT EXISTS estrazioni_pagina (
+    documento_id INTEGER NOT NULL REFERENCES documenti(id) ON DELETE CASCADE,
+    pagina INTEGER NOT NULL,
+    risposta TEXT NOT NULL,
+    PRIMARY KEY (documento_id, pagina)
+);
+
+CREATE TABLE IF NOT EXISTS righe (
+    id INTEGER PRIMARY KEY,
+    documento_id INTEGER NOT NULL REFERENCES documenti(id) ON DELETE CASCADE,
+    codice TEXT NOT NULL,
+    codice_norm TEXT NOT NULL,
+    descrizione TEXT,
+    unita TEXT,
+    prezzo REAL,
+    quantita REAL,
+    costo_totale REAL
+);
+CREATE INDEX IF NOT EXISTS idx_righe_codice_norm ON righe(codice_norm);
+CREATE INDEX IF NOT EXISTS idx_righe_documento ON righe(documento_id);
+
+CREATE TABLE IF NOT EXISTS alias_codici (
+    tariffario_id INTEGER NOT NULL REFERENCES tariffari(id),
+    codice_norm TEXT NOT NULL,
+    chiave TEXT NOT NULL,
+    origine TEXT NOT NULL,
+    stato TEXT NOT NULL DEFAULT 'proposto',
+    occorrenze INTEGER NOT NULL DEFAULT 1,
+    aggiornato_il TEXT NOT NULL,
+    PRIMARY KEY (tariffario_id, codice_norm, chiave)
+);
+"""
+
+# Stati di un alias: i proposti vengono usati finche' non sono rifiutati
+ALIAS_PROPOSTO = "proposto"
+ALIAS_CONFERMATO = "confermato"
+ALIAS_RIFIUTATO = "rifiutato"
+
+# Colonne aggiunte dopo la prima versione dello schema, create all'apertura degli archivi esistenti.
+# I documenti gia' archiviati risultano non completi e quindi non vengono riutilizzati.
+MIGRAZIONI = {
+    "tariffari": {"revisione_alias": "INTEGER NOT NULL DEFAULT 0"},
+    "documenti": {"completo": "INTEGER NOT NULL DEFAULT 0", "fonti": "TEXT"},
+}
+
+
+def hash_file(path: str) -> str:
+    """Calcola lo SHA-256 di un file leggendolo a blocchi."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for blocco in iter(lambda: f.read(1 << 20), b""):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+class ArchivioRisultati:
+    """
+    Archivio SQLite persistente di documenti elaborati, estrazioni per pagina,
+    righe abbinate, versioni del tariffario e alias dei codici appresi tra i documenti.
+    Ogni operazione apre una connessione propria, quindi l'archivio e' utilizzabile
+    dai thread concorrenti di Gradio.
+    """
+
+    def __init__(self, path: str = PATH_ARCHIVIO):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock_scrittura = threading.Lock()
+        with self._connessione() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            for tabella, colonne in MIGRAZIONI.items():
+                esistenti = {r["name"] for r in conn.execute(f"PRAGMA table_info({tabella})")}
+                for colonna, definizione in colonne.items():
+                    if colonna not in esistenti:
+                        conn.execute(f"ALTER TABLE {tabella} ADD COLUMN {colonna} {definizione}")
+
+    @contextmanager
+    def _connessione(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # --- Scrittura ---
+
+    def registra_tariffario(self, nome: str, hash_tariffario: str, voci: int) -> int:
+        """Registra una versione del tariffario (idempotente) e ne restituisce l'id."""
+        with self._lock_scrittura, self._connessione() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO tariffari (nome, hash, voci, caricato_il) VALUES (?, ?, ?, ?)",
+                (nome, hash_tariffario, voci, datetime.now().isoformat(timespec="seconds")),
+            )
+            riga = conn.execute("SELECT id FROM tariffari WHERE hash = ?", (hash_tariffario,)).fetchone()
+            return riga["id"]
+
+    def salva_documento(
+        self, hash_documento, nome, tariffario_id, estrazioni, righe, log="", output="", completo=True, fonti=()
+    ) -> int:
+        """
+        Salva un documento elaborato con le estrazioni per pagina e le righe abbinate.
+
+        Args:
+            estrazioni: iterabile di (numero_pagina, risposta_raw)
+            righe: iterabile di [codice, descrizione, unita, prezzo, quantita, costo_totale]
+            completo: False se qualche pagina non e' stata elaborata (il documento non verra' riutilizzato)
+            fonti: id dei tariffari usati oltre a tariffario_id (es. prezziari regionali)
+        """
+        with self._lock_scrittura, self._connessione() as conn:
+            versione = self._versione_fonti(conn, {tariffario_id, *fonti})
+            cur = conn.execute(
+                "INSERT INTO documenti (hash, nome, tariffario_id, elaborato_il, log, output, completo, fonti) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (hash_documento, nome, tariffario_id, datetime.now().isoformat(timespec="seconds"), log, output,
+                 int(completo), versione),
+            )
+            documento_id = cur.lastrowid
+            conn.executemany(
+                "INSERT OR REPLACE INTO estrazioni_pagina (documento_id, pagina, risposta) VALUES (?, ?, ?)",
+                ((documento_id, pagina, risposta) for pagina, risposta in estrazioni),
+            )
+            conn.executemany(
+                "INSERT INTO righe (documento_id, codice, codice_norm, descrizione, unita, prezzo, quantita, costo_totale) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((documento_id, r[0], normalizza_codice(r[0]), r[1], r[2], r[3], r[4], r[5]) for r in righe),
+            )
+            return documento_id
+
+    def registra_alias(self, tariffario_id: int, alias) -> None:
+        """
+        Registra le risoluzioni di codici non presenti nel tariffario (idempotente):
+        un alias nuovo nasce 'proposto', uno esistente incrementa solo le occorrenze
+        e mantiene stato e origine.
+
+        Args:
+            alias: iterabile di (codice_grezzo, chiave_tariffario, origine)
+        """
+        adesso = datetime.now().isoformat(timespec="seconds")
+        with self._lock_scrittura, self._connessione() as conn:
+            conn.executemany(
+                "INSERT INTO alias_codici (tariffario_id, codice_norm, chiave, origine, aggiornato_il) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (tariffario_id, codice_norm, chiave) "
+                "DO UPDATE SET occorrenze = occorrenze + 1, aggiornato_il = excluded.aggiornato_il",
+                ((tariffario_id, normalizza_codice(codice), chiave, origine, adesso) for codice, chiave, origine in alias),
+            )
+
+    def imposta_stato_alias(self, tariffario_id: int, codice: str, chiave: str, stato: str) -> None:
+        """
+        Conferma o rifiuta un alias. Confermare un alias inesistente lo crea con origine 'manuale';
+        alla conferma gli altri alias proposti per lo stesso codice vengono rifiutati.
+        """
+        if stato not in (ALIAS_CONFERMATO, ALIAS_RIFIUTATO):
+            raise ValueError(f"Stato alias non valido: {stato}")
+        codice_norm = normalizza_codice(codice)
+        adesso = datetime.now().isoformat(timespec="seconds")
+        with self._lock_scrittura, self._connessione() as conn:
+            conn.execute(
+                "INSERT INTO alias_codici (tariffario_id, codice_norm, chiave, origine, stato, occorrenze, aggiornato_il) "
+                "VALUES (?, ?, ?, 'manuale', ?, 0, ?) "
+                "ON CONFLICT (tariffario_id, codice_norm, chiave) "
+                "DO UPDATE SET stato = excluded.stato, aggiornato_il = excluded.aggiornato_il",
+                (tariffario_id, codice_norm, chiave, stato, adesso),
+            )
+            if stato == ALIAS_CONFERMATO:
+                conn.execute(
+                    "UPDATE alias_codici SET stato = ?, aggiornato_il = ? "
+                    "WHERE tariffario_id = ? AND codice_norm = ? AND chiave != ? AND stato = ?",
+                    (ALIAS_RIFIUTATO, adesso, tariffario_id, codice_norm, chiave, ALIAS_PROPOSTO),
+                )
+            # I documenti elaborati con gli alias precedenti non vanno piu' riutilizzati
+            conn.execute("UPDATE tariffari SET revisione_alias = revisione_alias + 1 WHERE id = ?", (tariffario_id,))
+
+    # --- Interrogazioni ---
+
+    @staticmethod
+    def _versione_fonti(conn, ids) -> str:
+        """Versione dei tariffari usati da un documento: 'id:revisione_alias' ordinati per id."""
+        ids = [i for i in ids if i is not None]
+        segnaposto = ",".join("?" * len(ids))
+        righe = conn.execute(
+            f"SELECT id, revisione_alias FROM tariffari WHERE id IN ({segnaposto}) ORDER BY id", list(ids)
+        ).fetchall()
+        return ",".join(f"{r['id']}:{r['revisione_alias']}" for r in righe)
+
+    def versione_fonti(self, ids) -> str:
+        """Versione attuale dei tariffari indicati, confrontabile con la colonna documenti.fonti."""
+        with self._connessione() as conn:
+            return self._versione_fonti(conn, set(ids))
+
+    def tariffario_per_id(self, tariffario_id: int):
+        """Versione registrata del tariffario (dict con id, nome, hash, voci), None se assente."""
+        with self._connessione() as conn:
+            riga = conn.execute("SELECT * FROM tariffari WHERE id = ?", (tariffario_id,)).fetchone()
+            return dict(riga) if riga is not None else None
+
+    @staticmethod
+    def _con_righe(conn, documento):
+        risultato = dict(documento)
+        righe = conn.execute(
+            "SELECT codice, descrizione, unita, prezzo, quantita, costo_totale "
+            "FROM righe WHERE documento_id = ? ORDER BY id",
+            (documento["id"],),
+        ).fetchall()
+        risultato["righe"] = [list(r) for r in righe]
+        return risultato
+
+    def documento_per_hash(self, hash_documento: str, tariffario_id: int | None = None, solo_completi: bool = False):
+        """
+        Restituisce l'ultima elaborazione di un documento (dict con le colonne del documento
+        e 'righe'), opzionalmente limitata a una versione del tariffario e alle elaborazioni
+        complete. None se assente.
+        """
+        query = "SELECT * FROM documenti WHERE hash = ?"
+        parametri = [hash_documento]
+        if solo_completi:
+            query += " AND completo = 1"
+        if tariffario_id is not None:
+            query += " AND tariffario_id = ?"
+            parametri.append(tariffario_id)
+        query += " ORDER BY elaborato_il DESC, id DESC LIMIT 1"
+
+        with self._connessione() as conn:
+            documento = conn.execute(query, parametri).fetchone()
+            return self._con_righe(conn, documento) if documento is not None else None
+
+    def documento_per_id(self, documento_id: int):
+        """Come documento_per_hash ma per id interno."""
+        with self._connessione() as conn:
+            documento = conn.execute("SELECT * FROM documenti WHERE id = ?", (documento_id,)).fetchone()
+            return self._con_righe(conn, documento) if documento is not None else None
+
+    def cerca_codice(self, codice: str, dal: str | None = None, al: str | None = None) -> list[list]:
+        """
+        Storico prezzi di un codice (normalizzato) nei documenti elaborati.
+        `dal` e `al` sono date ISO (YYYY-MM-DD) opzionali, estremi inclusi.
+
+        Ritorna righe [data, documento, codice, descrizione, unita, prezzo, quantita, costo_totale].
+        """
+        query = (
+            "SELECT d.elaborato_il, d.nome, r.codice, r.descrizione, r.unita, r.prezzo, r.quantita, r.costo_totale "
+            "FROM righe r JOIN documenti d ON d.id = r.documento_id "
+            "WHERE r.codice_norm = ?"
+        )
+        parametri = [normalizza_codice(codice)]
+        if dal:
+            query += " AND d.elaborato_il >= ?"
+            parametri.append(dal)
+        if al:
+            # Include tutta la giornata finale
+            query += " AND d.elaborato_il < date(?, '+1 day')"
+            parametri.append(al)
+        query += " ORDER BY d.elaborato_il DESC"
+
+        with self._connessione() as conn:
+            return [list(r) for r in conn.execute(query, parametri).fetchall()]
+
+    def elenco_documenti(self, nome: str | None = None, limite: int = 100) -> list[list]:
+        """Ultimi documenti elaborati: [id, data, nome, hash, tariffario, voci]."""
+        query = (
+            "SELECT d.id, d.elaborato_il, d.nome, d.hash, t.nome, "
+            "(SELECT COUNT(*) FROM righe r WHERE r.documento_id = d.id) "
+            "FROM documenti d JOIN tariffari t ON t.id = d.tariffario_id"
+        )
+        parametri = []
+        if nome:
+            query += " WHERE d.nome LIKE ?"
+            parametri.append(f"%{nome}%")
+        query += " ORDER BY d.elaborato_il DESC LIMIT ?"
+        parametri.append(limite)
+
+        with self._connessione() as conn:
+            return [list(r) for r in conn.execute(query, parametri).fetchall()]
+
+    def alias_tariffario(self, tariffario_id: int) -> tuple[dict, set]:
+        """
+        Alias utilizzabili per una versione del tariffario.
+
+        Returns:
+            ({codice_norm: (chiave, stato)}, {(codice_norm, chiave) rifiutati}). Per ogni codice
+            vale l'alias confermato; in sua assenza quello proposto, solo se e' l'unico candidato.
+        """
+        attivi = {}
+        candidati = {}
+        rifiutati = set()
+        with self._connessione() as conn:
+            righe = conn.execute(
+                "SELECT codice_norm, chiave, stato FROM alias_codici WHERE tariffario_id = ?", (tariffario_id,)
+            ).fetchall()
+        for codice_norm, chiave, stato in righe:
+            if stato == ALIAS_CONFERMATO:
+                attivi[codice_norm] = (chiave, stato)
+            elif stato == ALIAS_PROPOSTO:
+                candidati.setdefault(codice_norm, []).append(chiave)
+            else:
+                rifiutati.add((codice_norm, chiave))
+        for codice_norm, chiavi in candidati.items():
+            if codice_norm not in attivi and len(chiavi) == 1:
+                attivi[codice_norm] = (chiavi[0], ALIAS_PROPOSTO)
+        return attivi, rifiutati
+
+    def elenco_alias(self, tariffario_id: int, stato: str | None = None, limite: int = 500) -> list[list]:
+        """Alias di una versione del tariffario: [codice, chiave, origine, stato, occorrenze, aggiornato_il]."""
+        query = (
+            "SELECT codice_norm, chiave, origine, stato, occorrenze, aggiornato_il "
+            "FROM alias_codici WHERE tariffario_id = ?"
+        )
+        parametri = [tariffario_id]
+        if stato:
+            query += " AND stato = ?"
+            parametri.append(stato)
+        query += " ORDER BY occorrenze DESC, aggiornato_il DESC LIMIT ?"
+        parametri.append(limite)
+
+        with self._connessione() as conn:
+            return [list(r) for r in conn.execute(query, parametri).fetchall()]
@@ -0,0 +1,136 @@
+import re
+import threading
+
+from service.service_main import normalizza_codice
+from service.triage import RE_CODICE
+
+# Prezzi per milione di token (input, output) in USD, per il confronto costi tra i livelli
+PREZZI_MODELLI = {
+    "claude-haiku-4-5": (1.0, 5.0),
+    "claude-sonnet-4-5": (3.0, 15.0),
+    "claude-opus-4-1": (15.0, 75.0),
+}
+
+RE_NUMERO_TESTO = re.compile(r'^\d{1,3}(?:\.\d{3})+(?:,\d+)?$|^\d+(?:[.,]\d+)?$')
+
+
+def _prezzo(modello: str):
+    """Prezzo del modello, riconosciuto anche con suffisso di data (es. claude-sonnet-4-5-20250929)."""
+    for nome, prezzo in PREZZI_MODELLI.items():
+        if modello.startswith(nome):
+            return prezzo
+    return None
+
+
+def numeri_text_layer(page) -> set:
+    """
+    Valori numerici presenti nel text layer della pagina, arrotondati al centesimo.
+    I numeri ambigui (es. 1.500) vengono registrati in entrambe le letture.
+    """
+    numeri = set()
+    for parola in page.get_text("words"):
+        token = parola[4].strip()
+        if not RE_NUMERO_TESTO.match(token):
+            continue
+        if "," in token:
+            numeri.add(round(float(token.replace(".", "").replace(",", ".")), 2))
+        else:
+            numeri.add(round(float(token), 2))
+            if "." in token:
+                numeri.add(round(float(token.replace(".", "")), 2))
+    return numeri
+
+
+def valuta_confidenza(
+    testo: str,
+    tuple_pagina: list,
+    tariffario_norm: dict,
+    numeri_pagina: set | None = None,
+    codici_attesi: int | None = None,
+    soglia_tariffario: float = 0.8,
+    soglia_codici: float = 0.9,
+    soglia_quantita: float = 0.8,
+    min_numeri_voci: int = 5,
+) -> tuple[bool, str]:
+    """
+    Valuta localmente l'affidabilita' dell'estrazione di una pagina:
+    la risposta contiene una lista, i codici hanno una forma valida, una quota sufficiente
+    e' presente nel tariffario (via tariffario_norm) e, se la pagina ha un text layer,
+    le quantita' compaiono tra i numeri della pagina e non mancano voci.
+
+    Una pagina senza voci estratte e' affidabile solo se il text layer lo conferma
+    (nessun codice e meno di `min_numeri_voci` numeri): per le scansioni e le pagine
+    tenute dal triage per numeri o tabelle la risposta vuota va riverificata.
+
+    Returns:
+        (affidabile, motivo)
+    """
+    if "[" not in testo:
+        return False, "risposta senza lista"
+    if not tuple_pagina:
+        if codici_attesi:
+            return False, f"nessuna voce estratta su {codici_attesi} codici nel text layer"
+        if codici_attesi is None:
+            return False, "nessuna voce estratta da una pagina senza text layer"
+        if len(numeri_pagina or ()) >= min_numeri_voci:
+            return False, f"nessuna voce estratta su una pagina con {len(numeri_pagina)} numeri"
+        return True, "pagina senza voci"
+
+    totale = len(tuple_pagina)
+    if codici_attesi and totale < codici_attesi * 0.5:
+        return False, f"estratte {totale} voci su {codici_attesi} codici nel text layer"
+
+    validi = sum(1 for codice, _ in tuple_pagina if RE_CODICE.match(codice))
+    if validi / totale < soglia_codici:
+        return False, f"codici non validi ({validi}/{totale})"
+
+    nel_tariffario = sum(1 for codice, _ in tuple_pagina if normalizza_codice(codice) in tariffario_norm)
+    if nel_tariffario / totale < soglia_tariffario:
+        return False, f"codici nel tariffario {nel_tariffario}/{totale}"
+
+    if numeri_pagina:
+        confermate = sum(1 for _, quantita in tuple_pagina if round(quantita, 2) in numeri_pagina)
+        if confermate / totale < soglia_quantita:
+            return False, f"quantita' confermate dal text layer {confermate}/{totale}"
+
+    return True, f"{nel_tariffario}/{totale} nel tariffario"
+
+
+class StatisticheModelli:
+    """Statistiche per livello della cascata: richieste, pagine, latenza, token e costo stimato."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.livelli = {}
+
+    def registra(self, modello: str, pagine: int, latenza: float, usage=None):
+        with self._lock:
+            s = self.livelli.setdefault(
+                modello, {"richieste": 0, "pagine": 0, "latenza": 0.0, "input": 0, "output": 0}
+            )
+            s["richieste"] += 1
+            s["pagine"] += pagine
+            s["latenza"] += latenza
+            if usage is not None:
+                s["input"] += getattr(usage, "input_tokens", 0) or 0
+                s["output"] += getattr(usage, "output_tokens", 0) or 0
+
+    def costo(self, modello: str) -> float | None:
+        prezzo = _prezzo(modello)
+        if prezzo is None:
+            return None
+        s = self.livelli[modello]
+        return (s["input"] * prezzo[0] + s["output"] * prezzo[1]) / 1_000_000
+
+    def righe(self) -> list[str]:
+        """Una riga di riepilogo per livello."""
+        righe = []
+        for modello, s in self.livelli.items():
+            costo = self.costo(modello)
+            righe.append(
+                f"{modello}: {s['richieste']} richieste, {s['pagine']} pagine, "
+                f"latenza media {s['latenza'] / max(s['richieste'], 1):.1f}s, "
+                f"token {s['input']}/{s['output']}"
+                + (f", costo ~${costo:.4f}" if costo is not None else "")
+            )
+        return righe
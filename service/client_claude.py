@@ -0,0 +1,273 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+# Codici HTTP per cui ha senso ritentare la chiamata
+STATUS_RITENTABILI = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class CircuitoApertoError(RuntimeError):
+    """Sollevata quando il circuit breaker resta aperto oltre il tempo concesso dai tentativi rimasti."""
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe.
+    La capacita' e la velocita' di ricarica vengono riallineate ai valori
+    comunicati dall'API negli header anthropic-ratelimit-*.
+    """
+
+    def __init__(self, capacita: float, ricarica_al_secondo: float):
+        self.capacita = capacita
+        self.ricarica_al_secondo = ricarica_al_secondo
+        self.disponibili = capacita
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _ricarica(self):
+        adesso = time.monotonic()
+        trascorso = adesso - self._ultimo
+        self._ultimo = adesso
+        self.disponibili = min(self.capacita, self.disponibili + trascorso * self.ricarica_al_secondo)
+
+    def preleva(self, quantita: float = 1.0):
+        """Blocca finche' non sono disponibili `quantita` token, poi li consuma."""
+        quantita = min(quantita, self.capacita)
+        while True:
+            with self._lock:
+                self._ricarica()
+                if self.disponibili >= quantita:
+                    self.disponibili -= quantita
+                    return
+                mancanti = quantita - self.disponibili
+                attesa = mancanti / self.ricarica_al_secondo if self.ricarica_al_secondo > 0 else 1.0
+            time.sleep(min(attesa, 5.0))
+
+    def sincronizza(self, limite: float | None, rimanenti: float | None, reset_tra: float | None):
+        """Riallinea il bucket ai valori letti dagli header di risposta."""
+        with self._lock:
+            self._ricarica()
+            if limite:
+                self.capacita = limite
+                # I limiti Anthropic sono espressi per minuto
+                self.ricarica_al_secondo = limite / 60.0
+            if rimanenti is not None:
+                self.disponibili = min(self.disponibili, rimanenti)
+            if rimanenti == 0 and reset_tra:
+                # Svuota il bucket fino al reset comunicato dal server
+                self.disponibili = -reset_tra * self.ricarica_al_secondo
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker a tre stati (chiuso, aperto, semi-aperto).
+    Si apre dopo `soglia_errori` errori consecutivi e resta aperto per `pausa` secondi;
+    poi lascia passare una sola chiamata di prova, il cui esito va sempre registrato
+    con successo(), errore() o rilascia().
+    """
+
+    def __init__(self, soglia_errori: int = 5, pausa: float = 30.0):
+        self.soglia_errori = soglia_errori
+        self.pausa = pausa
+        self.errori_consecutivi = 0
+        self.stato = "chiuso"
+        self._aperto_dal = 0.0
+        self._lock = threading.Lock()
+
+    def attesa(self) -> float:
+        """
+        Secondi da attendere prima di chiamare; 0 se la chiamata puo' partire.
+        Allo scadere della pausa la chiamata che ottiene 0 diventa quella di prova.
+        """
+        with self._lock:
+            if self.stato == "aperto":
+                residuo = self.pausa - (time.monotonic() - self._aperto_dal)
+                if residuo > 0:
+                    return residuo
+                self.stato = "semi-aperto"
+                return 0.0
+            if self.stato == "semi-aperto":
+                # Una chiamata di prova e' gia' in corso: si attende il suo esito
+                return min(1.0, self.pausa)
+            return 0.0
+
+    def successo(self):
+        with self._lock:
+            self.errori_consecutivi = 0
+            self.stato = "chiuso"
+
+    def errore(self):
+        with self._lock:
+            self.errori_consecutivi += 1
+            if self.stato == "semi-aperto" or self.errori_consecutivi >= self.soglia_errori:
+                self.stato = "aperto"
+                self._aperto_dal = time.monotonic()
+
+    def rilascia(self):
+        """Esito neutro (es. 429 o eccezione imprevista): chiude la prova senza azzerare gli errori."""
+        with self._lock:
+            if self.stato == "semi-aperto":
+                self.stato = "chiuso"
+
+
+def _header_float(headers, nome):
+    valore = headers.get(nome) if headers is not None else None
+    if valore is None:
+        return None
+    try:
+        return float(valore)
+    except ValueError:
+        return None
+
+
+def _secondi_al_reset(headers, nome):
+    """Converte un header di reset RFC 3339 nei secondi mancanti."""
+    valore = headers.get(nome) if headers is not None else None
+    if not valore:
+        return None
+    try:
+        istante = datetime.fromisoformat(valore.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return max(0.0, (istante - datetime.now(timezone.utc)).total_seconds())
+
+
+def stima_token_input(kwargs) -> int:
+    """Stima grossolana dei token di input di una richiesta (testo ~4 caratteri/token, immagini ~1600 token)."""
+    totale = len(str(kwargs.get("system", ""))) // 4
+    for messaggio in kwargs.get("messages", []):
+        contenuto = messaggio.get("content", "")
+        if isinstance(contenuto, str):
+            totale += len(contenuto) // 4
+            continue
+        for blocco in contenuto:
+            if blocco.get("type") == "image":
+                totale += 1600
+            else:
+                totale += len(blocco.get("text", "")) // 4
+    return max(totale, 1)
+
+
+class ClientClaudeResiliente:
+    """
+    Wrapper condiviso attorno al client Anthropic.
+    Applica un token bucket (richieste e token di input) allineato agli header di rate limit,
+    ritenta gli errori transitori (429, 529, 5xx, rete) con backoff esponenziale e jitter
+    e apre un circuit breaker quando gli errori del server persistono. I 429 non contano
+    per il circuito: li gestiscono il bucket e retry-after.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_tentativi: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        soglia_circuito: int = 5,
+        pausa_circuito: float = 30.0,
+        richieste_al_minuto: float = 50,
+        token_al_minuto: float = 40000,
+        log=print,
+    ):
+        self.client = client
+        self.max_tentativi = max_tentativi
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket_richieste = TokenBucket(richieste_al_minuto, richieste_al_minuto / 60.0)
+        self.bucket_token = TokenBucket(token_al_minuto, token_al_minuto / 60.0)
+        self.circuito = CircuitBreaker(soglia_circuito, pausa_circuito)
+        self.log = log
+
+    def _aggiorna_limiti(self, headers):
+        self.bucket_richieste.sincronizza(
+            _header_float(headers, "anthropic-ratelimit-requests-limit"),
+            _header_float(headers, "anthropic-ratelimit-requests-remaining"),
+            _secondi_al_reset(headers, "anthropic-ratelimit-requests-reset"),
+        )
+        self.bucket_token.sincronizza(
+            _header_float(headers, "anthropic-ratelimit-input-tokens-limit"),
+            _header_float(headers, "anthropic-ratelimit-input-tokens-remaining"),
+            _secondi_al_reset(headers, "anthropic-ratelimit-input-tokens-reset"),
+        )
+
+    def _attesa_backoff(self, tentativo, headers):
+        """Backoff esponenziale con full jitter; rispetta retry-after se presente."""
+        attesa = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativo))
+        retry_after = _header_float(headers, "retry-after")
+        if retry_after is not None:
+            attesa = max(attesa, retry_after)
+        return attesa
+
+    def _attendi_circuito(self, scadenza: float):
+        """
+        Attende che il circuito lasci passare la chiamata. Solleva CircuitoApertoError
+        se la pausa termina oltre `scadenza` (il tempo concesso dai tentativi rimasti).
+        """
+        while True:
+            attesa = self.circuito.attesa()
+            if attesa <= 0:
+                return
+            if time.monotonic() + attesa > scadenza:
+                raise CircuitoApertoError(
+                    f"Circuit breaker aperto dopo {self.circuito.errori_consecutivi} errori consecutivi: "
+                    f"pausa di {attesa:.0f}s oltre i tentativi rimasti"
+                )
+            self.log(f"  Circuit breaker {self.circuito.stato}: attesa di {attesa:.1f}s")
+            time.sleep(attesa)
+
+    def crea_messaggio(self, **kwargs):
+        """
+        Equivalente di client.messages.create(**kwargs) con rate limiting, retry e circuit breaker.
+        Se il circuito e' aperto attende la fine della pausa, entro il tempo che i tentativi
+        rimasti avrebbero speso in backoff. Solleva l'ultima eccezione se tutti i tentativi
+        falliscono, oppure CircuitoApertoError se il circuito resta aperto oltre quel tempo.
+        """
+        # Import differito: l'SDK e' pesante e serve solo alla prima chiamata
+        import anthropic
+
+        token_stimati = stima_token_input(kwargs)
+        scadenza = time.monotonic() + sum(
+            min(self.backoff_max, self.backoff_base * 2 ** t) for t in range(self.max_tentativi)
+        )
+
+        for tentativo in range(self.max_tentativi):
+            self._attendi_circuito(scadenza)
+            self.bucket_richieste.preleva(1)
+            self.bucket_token.preleva(token_stimati)
+
+            # Esito per il circuito: True successo, False errore del server, None neutro
+            esito = None
+            try:
+                raw = self.client.messages.with_raw_response.create(**kwargs)
+            except anthropic.APIStatusError as e:
+                headers = e.response.headers if e.response is not None else None
+                self._aggiorna_limiti(headers)
+                if e.status_code not in STATUS_RITENTABILI:
+                    # Errore della richiesta (400, 401, ...): il server risponde, inutile ritentare
+                    esito = True
+                    raise
+                if e.status_code != 429:
+                    esito = False
+                errore = e
+            except anthropic.APIConnectionError as e:
+                headers = None
+                esito = False
+                errore = e
+            else:
+                esito = True
+                self._aggiorna_limiti(raw.headers)
+                return raw.parse()
+            finally:
+                if esito is True:
+                    self.circuito.successo()
+                elif esito is False:
+                    self.circuito.errore()
+                else:
+                    self.circuito.rilascia()
+
+            if tentativo == self.max_tentativi - 1:
+                raise errore
+            attesa = self._attesa_backoff(tentativo, headers)
+            self.log(f"  Tentativo {tentativo + 1}/{self.max_tentativi} fallito ({errore}), nuovo tentativo tra {attesa:.1f}s")
+            time.sleep(attesa)
@@ -0,0 +1,212 @@
+import os
+import csv
+import time
+import uuid
+import importlib.util
+
+from service.service_main import OUTPUT_DIR
+
+FORMATI_SUPPORTATI = ("csv", "xlsx", "parquet")
+# Moduli richiesti dai formati opzionali, con il pacchetto da installare
+DIPENDENZE_FORMATI = {"xlsx": ("openpyxl", "openpyxl"), "parquet": ("pyarrow.parquet", "pyarrow")}
+
+# Tabelle esportate e relative colonne
+COLONNE = {
+    "risultati": ["codice", "descrizione", "unita", "prezzo_unitario", "quantita", "costo_totale"],
+    "match_fuzzy": ["codice_pdf", "codice_tariffario"],
+    "non_trovati": ["codice"],
+}
+
+
+def verifica_formati(formati) -> list[str]:
+    """
+    Normalizza e valida i formati di export, controllando che le dipendenze opzionali siano
+    installate senza importarle. Da chiamare all'avvio, cosi' un errore di configurazione
+    emerge prima di elaborare un documento.
+
+    Raises:
+        ValueError: formato non supportato
+        ImportError: dipendenza del formato non installata
+    """
+    formati = [f.strip().lower() for f in formati if f and f.strip()]
+    sconosciuti = [f for f in formati if f not in FORMATI_SUPPORTATI]
+    if sconosciuti:
+        raise ValueError(f"Formati di export non supportati: {sconosciuti}. Disponibili: {FORMATI_SUPPORTATI}")
+    for formato in formati:
+        if formato in DIPENDENZE_FORMATI:
+            modulo, pacchetto = DIPENDENZE_FORMATI[formato]
+            if importlib.util.find_spec(modulo.split(".")[0]) is None:
+                raise ImportError(f"Per l'export {formato} installare {pacchetto} (pip install {pacchetto})")
+    return formati
+
+
+class _ScrittoreCsv:
+    """Scrive una tabella CSV riga per riga."""
+
+    def __init__(self, base_path, tabella):
+        self.path = f"{base_path}_{tabella}.csv"
+        self._file = open(self.path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._file, delimiter=";")
+        self._writer.writerow(COLONNE[tabella])
+
+    def scrivi(self, riga):
+        self._writer.writerow(riga)
+
+    def chiudi(self):
+        self._file.close()
+
+
+class _ScrittoreParquet:
+    """Scrive una tabella Parquet a row group, tenendo in memoria al massimo `dimensione_blocco` righe."""
+
+    def __init__(self, base_path, tabella, dimensione_blocco=5000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Per l'export Parquet installare pyarrow (pip install pyarrow)") from e
+
+        self._pa = pa
+        self.path = f"{base_path}_{tabella}.parquet"
+        self._colonne = COLONNE[tabella]
+        tipi = {
+            "prezzo_unitario": pa.float64(),
+            "quantita": pa.float64(),
+            "costo_totale": pa.float64(),
+        }
+        self._schema = pa.schema([(c, tipi.get(c, pa.string())) for c in self._colonne])
+        self._writer = pq.ParquetWriter(self.path, self._schema)
+        self._dimensione_blocco = dimensione_blocco
+        self._buffer = []
+
+    def scrivi(self, riga):
+        self._buffer.append(riga)
+        if len(self._buffer) >= self._dimensione_blocco:
+            self._svuota()
+
+    def _svuota(self):
+        if not self._buffer:
+            return
+        colonne = list(zip(*self._buffer))
+        tabella = self._pa.Table.from_arrays(
+            [self._pa.array(valori, type=campo.type) for valori, campo in zip(colonne, self._schema)],
+            schema=self._schema,
+        )
+        self._writer.write_table(tabella)
+        self._buffer = []
+
+    def chiudi(self):
+        self._svuota()
+        self._writer.close()
+
+
+class _CartellaXlsx:
+    """Cartella XLSX in modalita' write-only: un foglio per tabella, righe scritte in streaming."""
+
+    def __init__(self, base_path):
+        try:
+            from openpyxl import Workbook
+        except ImportError as e:
+            raise ImportError("Per l'export XLSX installare openpyxl (pip install openpyxl)") from e
+
+        self.path = f"{base_path}.xlsx"
+        self._workbook = Workbook(write_only=True)
+
+    def foglio(self, tabella):
+        foglio = self._workbook.create_sheet(title=tabella)
+        foglio.append(COLONNE[tabella])
+        return _FoglioXlsx(foglio)
+
+    def chiudi(self):
+        self._workbook.save(self.path)
+
+
+class _FoglioXlsx:
+    def __init__(self, foglio):
+        self._foglio = foglio
+
+    def scrivi(self, riga):
+        self._foglio.append(list(riga))
+
+    def chiudi(self):
+        pass
+
+
+class EsportatoreRisultati:
+    """
+    Esporta in streaming le righe dei risultati, l'audit dei match fuzzy e i codici non trovati
+    nei formati richiesti (csv, xlsx, parquet) dentro OUTPUT_DIR.
+
+    Uso:
+        with EsportatoreRisultati("computo", formati=["csv", "parquet"]) as exp:
+            exp.scrivi_risultato(riga)
+            exp.scrivi_fuzzy(codice_pdf, codice_tariffario)
+            exp.scrivi_non_trovato(codice)
+        exp.file_prodotti  # percorsi dei file scritti
+    """
+
+    def __init__(self, nome_documento: str, formati=("csv",), cartella: str = OUTPUT_DIR):
+        formati = verifica_formati(formati)
+
+        os.makedirs(cartella, exist_ok=True)
+        nome = os.path.splitext(os.path.basename(nome_documento))[0] or "documento"
+        self.base_path = os.path.join(cartella, f"{nome}_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}")
+        self.formati = formati
+        self.file_prodotti = []
+        self._contenitori = []
+        self._scrittori = {tabella: [] for tabella in COLONNE}
+
+    def __enter__(self):
+        try:
+            for formato in self.formati:
+                if formato == "xlsx":
+                    cartella_xlsx = _CartellaXlsx(self.base_path)
+                    self._contenitori.append(cartella_xlsx)
+                    for tabella in COLONNE:
+                        self._scrittori[tabella].append(cartella_xlsx.foglio(tabella))
+                else:
+                    # csv e parquet: un file per tabella
+                    classe = _ScrittoreCsv if formato == "csv" else _ScrittoreParquet
+                    for tabella in COLONNE:
+                        scrittore = classe(self.base_path, tabella)
+                        self._contenitori.append(scrittore)
+                        self._scrittori[tabella].append(scrittore)
+        except BaseException:
+            # __exit__ non viene chiamato: si chiudono e rimuovono i file gia' aperti
+            self._annulla()
+            raise
+        return self
+
+    def _annulla(self):
+        for contenitore in self._contenitori:
+            try:
+                contenitore.chiudi()
+            except Exception:
+                pass
+            if os.path.exists(contenitore.path):
+                os.remove(contenitore.path)
+        self._contenitori = []
+        self._scrittori = {tabella: [] for tabella in COLONNE}
+
+    def __exit__(self, exc_type, exc, tb):
+        for contenitore in self._contenitori:
+            contenitore.chiudi()
+            self.file_prodotti.append(contenitore.path)
+        return False
+
+    def _scrivi(self, tabella, riga):
+        for scrittore in self._scrittori[tabella]:
+            scrittore.scrivi(riga)
+
+    def scrivi_risultato(self, riga):
+        """riga: [codice, descrizione, unita, prezzo, quantita, costo_totale]"""
+        self._scrivi("risultati", [
+            str(riga[0]), str(riga[1]), str(riga[2]),
+            float(riga[3]), float(riga[4]), float(riga[5]),
+        ])
+
+    def scrivi_fuzzy(self, codice_pdf, codice_tariffario):
+        self._scrivi("match_fuzzy", [str(codice_pdf), str(codice_tariffario)])
+
+    def scrivi_non_trovato(self, codice):
+        self._scrivi("non_trovati", [str(codice)])
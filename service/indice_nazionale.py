@@ -0,0 +1,227 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+from service.service_main import (
+    PATH_PREZZIARI, IndiceCanonico, carica_tariffario_regione, lista_regioni, mappa_normalizzata, normalizza_codice,
+    pulisci_codice,
+)
+
+# Prefisso regionale dei codici: sigla di tre lettere e anno (es. CAM25_MT.L11..., TOS25_01.A03..., CAL25.E01...)
+RE_PREFISSO = re.compile(r'^([A-Z]{3})(\d{2})(?!\d)')
+RE_PRIMA_TARIFFA = re.compile(r'<Tariffa>\s*(.*?)\s*</Tariffa>', re.DOTALL)
+
+# Sigle regionali usate nei prezziari, per associare le cartelle di Prezziari/ quando lo sniffing non basta
+SIGLE_REGIONI = {
+    "ABR": "abruzzo", "BAS": "basilicata", "CAL": "calabria", "CAM": "campania",
+    "EMR": "emilia", "FVG": "friuli", "LAZ": "lazio", "LIG": "liguria",
+    "LOM": "lombardia", "MAR": "marche", "MOL": "molise", "PIE": "piemonte",
+    "PUG": "puglia", "SAR": "sardegna", "SIC": "sicilia", "TOS": "toscana",
+    "TAA": "trentino", "UMB": "umbria", "VDA": "aosta", "VEN": "veneto",
+}
+
+
+def prefisso_codice(codice: str) -> str | None:
+    """Prefisso regionale del codice (es. 'CAM25'), None se il codice non ne ha uno."""
+    trovato = RE_PREFISSO.match(pulisci_codice(codice))
+    return trovato.group(1) + trovato.group(2) if trovato else None
+
+
+def togli_prefisso(codice: str) -> str:
+    """Codice senza prefisso regionale e separatore successivo (es. 'CAM25_MT.L11' -> 'MT.L11')."""
+    trovato = RE_PREFISSO.match(codice)
+    return codice[trovato.end():].lstrip("._-") if trovato else codice
+
+
+def _prima_tariffa(path: str, blocco: int = 1 << 16, limite: int = 1 << 22) -> str | None:
+    """Primo codice <Tariffa> di un file XML, leggendo solo l'inizio del file."""
+    letto = ""
+    with open(path, "r", encoding="UTF-8", errors="ignore") as f:
+        while len(letto) < limite:
+            parte = f.read(blocco)
+            if not parte:
+                break
+            letto += parte
+            trovato = RE_PRIMA_TARIFFA.search(letto)
+            if trovato:
+                return trovato.group(1)
+    return None
+
+
+def _hash_regione(path_regione: str) -> str:
+    """Hash della versione di una regione, calcolato da nome, dimensione e data dei file."""
+    h = hashlib.sha256()
+    for nome in sorted(os.listdir(path_regione)):
+        stat = os.stat(os.path.join(path_regione, nome))
+        h.update(f"{nome}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ShardTariffario:
+    """
+    Voci di un tariffario (regionale o CSV) con gli indici per il confronto:
+    mappa normalizzata {codice_normalizzato: chiave_xcode} e indice canonico.
+    Con senza_prefisso i codici del tariffario non riportano il prefisso regionale,
+    che va tolto dai codici letti prima della ricerca.
+    """
+
+    def __init__(
+        self, nome: str, tariffario: dict, tariffario_id: int | None = None, norm=None, canonico=None,
+        senza_prefisso: bool = False,
+    ):
+        self.nome = nome
+        self.tariffario = tariffario
+        self.tariffario_id = tariffario_id
+        self.norm = norm if norm is not None else mappa_normalizzata(tariffario)
+        self.canonico = canonico if canonico is not None else IndiceCanonico(tariffario)
+        self.senza_prefisso = senza_prefisso
+
+    def chiave(self, xcode: str) -> str:
+        """Codice pulito nella forma in cui va cercato in questo tariffario."""
+        return togli_prefisso(xcode) if self.senza_prefisso else xcode
+
+    def contiene(self, xcode: str) -> bool:
+        """True se il codice ha una corrispondenza esatta, normalizzata o canonica univoca."""
+        chiave = self.chiave(xcode)
+        return (
+            chiave in self.tariffario
+            or normalizza_codice(chiave) in self.norm
+            or len(self.canonico.cerca(chiave)) == 1
+        )
+
+
+class IndiceNazionale:
+    """
+    Indice nazionale dei prezziari di Prezziari/, suddiviso per regione.
+
+    Ogni codice viene instradato alla regione tramite il prefisso (es. CAM25 -> Campania):
+    la tabella prefisso -> regione si costruisce leggendo solo il primo <Tariffa> dei file
+    di ogni regione, mentre le voci di una regione (shard) vengono caricate alla prima
+    richiesta e tenute in cache fino a `max_shard` regioni. Le regioni associate per
+    sigla dal nome della cartella hanno codici senza prefisso (shard senza_prefisso).
+
+    Args:
+        registra: callable(nome, hash, voci) -> id che registra la versione dello shard
+            (es. ArchivioRisultati.registra_tariffario), opzionale
+    """
+
+    def __init__(self, max_shard: int = 4, registra=None, log=print):
+        self.max_shard = max_shard
+        self.registra = registra
+        self.log = log
+        self._prefissi = None
+        self._regioni_senza_prefisso = set()
+        self._errori = {}
+        self._shard = OrderedDict()
+        self._lock = threading.Lock()
+        self._lock_caricamento = threading.Lock()
+
+    def prefissi(self) -> dict:
+        """Tabella {prefisso: regione}; vuota se la cartella Prezziari non esiste."""
+        with self._lock:
+            if self._prefissi is None:
+                self._prefissi = self._costruisci_prefissi()
+            return self._prefissi
+
+    def _costruisci_prefissi(self) -> dict:
+        try:
+            regioni = lista_regioni()
+        except (FileNotFoundError, ValueError):
+            return {}
+        prefissi = {}
+        for regione in regioni:
+            path_regione = os.path.join(PATH_PREZZIARI, regione)
+            for nome in sorted(os.listdir(path_regione)):
+                try:
+                    prima = _prima_tariffa(os.path.join(path_regione, nome))
+                except OSError as e:
+                    self.log(f"  [WARN] Impossibile leggere {nome}: {e}")
+                    continue
+                prefisso = prefisso_codice(prima) if prima else None
+                if prefisso:
+                    prefissi.setdefault(prefisso, regione)
+        # Regioni senza codici riconosciuti: associazione per sigla dal nome della cartella
+        for sigla, nome_regione in SIGLE_REGIONI.items():
+            if any(p.startswith(sigla) for p in prefissi):
+                continue
+            for regione in regioni:
+                if nome_regione in regione.lower() and regione not in prefissi.values():
+                    prefissi[sigla] = regione
+                    self._regioni_senza_prefisso.add(regione)
+        return prefissi
+
+    def regione(self, codice: str) -> str | None:
+        """Regione a cui instradare il codice: per prefisso completo, altrimenti per sola sigla."""
+        prefisso = prefisso_codice(codice)
+        if prefisso is None:
+            return None
+        prefissi = self.prefissi()
+        if prefisso in prefissi:
+            return prefissi[prefisso]
+        regioni = {r for p, r in prefissi.items() if p[:3] == prefisso[:3]}
+        return regioni.pop() if len(regioni) == 1 else None
+
+    def versione_regione(self, regione: str) -> str | None:
+        """Hash della versione attuale dei file della regione, None se la cartella non esiste piu'."""
+        path_regione = os.path.join(PATH_PREZZIARI, regione)
+        return _hash_regione(path_regione) if os.path.isdir(path_regione) else None
+
+    def shard(self, regione: str) -> ShardTariffario:
+        """
+        Shard della regione, caricato alla prima richiesta (thread-safe).
+
+        Raises:
+            FileNotFoundError, ValueError: cartella della regione assente o senza file leggibili
+        """
+        self.prefissi()
+        with self._lock_caricamento:
+            if regione in self._shard:
+                self._shard.move_to_end(regione)
+                return self._shard[regione]
+
+            voci = {}
+            for codice, voce in carica_tariffario_regione(regione).items():
+                voci[pulisci_codice(codice)] = {
+                    'codice': codice,
+                    'descrizione': voce['descrizione'],
+                    'unita': voce.get('unita', ''),
+                    'prezzo': voce['prezzo'],
+                }
+            tariffario_id = None
+            if self.registra is not None:
+                tariffario_id = self.registra(regione, _hash_regione(os.path.join(PATH_PREZZIARI, regione)), len(voci))
+            shard = ShardTariffario(
+                regione, voci, tariffario_id, senza_prefisso=regione in self._regioni_senza_prefisso
+            )
+
+            self._shard[regione] = shard
+            while len(self._shard) > self.max_shard:
+                self._shard.popitem(last=False)
+            return shard
+
+    def shard_caricati(self) -> list[ShardTariffario]:
+        """Shard attualmente in cache."""
+        with self._lock_caricamento:
+            return list(self._shard.values())
+
+    def shard_per_codici(self, codici) -> dict:
+        """
+        Carica solo gli shard delle regioni referenziate dai codici: {regione: shard}.
+        Le regioni che non si riescono a caricare vengono segnalate e omesse, cosi' i loro
+        codici ricadono sul tariffario principale.
+        """
+        regioni = {self.regione(codice) for codice in codici} - {None}
+        shard = {}
+        for regione in sorted(regioni):
+            # Una regione non caricabile si riprova solo quando i suoi file cambiano
+            if regione in self._errori and self._errori[regione] == self.versione_regione(regione):
+                continue
+            try:
+                shard[regione] = self.shard(regione)
+                self._errori.pop(regione, None)
+            except (OSError, ValueError) as e:
+                self._errori[regione] = self.versione_regione(regione)
+                self.log(f"  [WARN] Prezziario regionale '{regione}' non caricato: {e}")
+        return shard
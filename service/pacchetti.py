@@ -0,0 +1,73 @@
+import re
+
+# Marcatore di pagina nelle richieste ("--- PAGINA N ---") e nelle risposte ("PAGINA N:")
+RE_MARCATORE_PAGINA = re.compile(r'-*\s*PAGINA\s+(\d+)\s*-*\s*:?', re.IGNORECASE)
+
+
+def pagina_sparsa(classificazione: dict, max_codici: int, max_altezza: float) -> bool:
+    """
+    True se la pagina contiene poche voci: pochi codici nel text layer oppure, per le
+    scansioni e le pagine senza codici riconosciuti (densita' ignota), un contenuto che
+    occupa una piccola parte dell'altezza della pagina.
+    """
+    if classificazione.get("codici"):
+        return classificazione["codici"] <= max_codici
+    altezza = classificazione.get("altezza_contenuto")
+    return altezza is not None and altezza <= max_altezza
+
+
+def pianifica_pacchetti(pagine, classificazioni, max_pagine: int = 4, max_codici: int = 5, max_altezza: float = 0.35):
+    """
+    Raggruppa in un'unica richiesta le pagine sparse consecutive (fino a max_pagine);
+    le pagine dense restano da sole.
+
+    Args:
+        pagine: indici (da 0) delle pagine da inviare, in ordine
+        classificazioni: classificazioni del triage indicizzate per pagina
+
+    Returns:
+        Lista di pacchetti, ciascuno una lista di indici di pagina.
+    """
+    pacchetti = []
+    corrente = []
+    for i in pagine:
+        sparsa = max_pagine > 1 and pagina_sparsa(classificazioni[i], max_codici, max_altezza)
+        consecutiva = bool(corrente) and i == corrente[-1] + 1
+        if sparsa and consecutiva and len(corrente) < max_pagine:
+            corrente.append(i)
+            continue
+        if corrente:
+            pacchetti.append(corrente)
+        corrente = [i]
+        if not sparsa:
+            # Le pagine dense non si accorpano con le successive
+            pacchetti.append(corrente)
+            corrente = []
+    if corrente:
+        pacchetti.append(corrente)
+    return pacchetti
+
+
+def dividi_risposta_per_pagina(testo: str, numeri_pagina: list[int]) -> tuple[dict, bool]:
+    """
+    Divide la risposta di una richiesta multipagina nei segmenti di ciascuna pagina,
+    usando i marcatori "PAGINA N" riportati da Claude.
+
+    Returns:
+        ({numero_pagina: testo_segmento}, attribuzione_certa). Le pagine senza marcatore
+        mancano dal dict; se la risposta non contiene marcatori validi il dict e' vuoto
+        e attribuzione_certa e' False (il testo non si puo' attribuire a nessuna pagina).
+    """
+    if len(numeri_pagina) == 1:
+        return {numeri_pagina[0]: testo}, True
+
+    segmenti = {}
+    marcatori = list(RE_MARCATORE_PAGINA.finditer(testo))
+    for k, marcatore in enumerate(marcatori):
+        numero = int(marcatore.group(1))
+        if numero not in numeri_pagina:
+            continue
+        fine = marcatori[k + 1].start() if k + 1 < len(marcatori) else len(testo)
+        segmenti[numero] = segmenti.get(numero, "") + testo[marcatore.end():fine]
+
+    return segmenti, bool(segmenti)
@@ -0,0 +1,45 @@
+import tempfile
+
+
+class RaccoltaRisposte:
+    """
+    Raccolta delle risposte grezze per pagina con memoria limitata.
+    Le risposte restano in memoria fino a `max_memoria` byte, poi vengono riversate
+    su un file temporaneo (SpooledTemporaryFile); l'iterazione le rilegge in ordine
+    senza mai caricarle tutte insieme.
+    """
+
+    def __init__(self, max_memoria: int = 8 * 1024 * 1024):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memoria, mode="w+b")
+        self.pagine = 0
+
+    def aggiungi(self, pagina: int, risposta: str):
+        dati = risposta.encode("utf-8")
+        self._file.seek(0, 2)
+        self._file.write(f"{pagina}\t{len(dati)}\n".encode("ascii"))
+        self._file.write(dati)
+        self.pagine += 1
+
+    @property
+    def su_disco(self) -> bool:
+        """True se la raccolta ha superato il budget ed e' stata riversata su disco."""
+        return self._file._rolled
+
+    def __iter__(self):
+        self._file.seek(0)
+        while True:
+            intestazione = self._file.readline()
+            if not intestazione:
+                return
+            pagina, lunghezza = intestazione.decode("ascii").split("\t")
+            yield int(pagina), self._file.read(int(lunghezza)).decode("utf-8")
+
+    def chiudi(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.chiudi()
+        return False
@@ -42,11 +42,111 @@ def normalizza_codice(codice: str) -> str:
     return c
 
 
+# Confusioni tipiche della lettura visiva dei codici: ogni carattere viene ricondotto a un rappresentante
+CONFUSIONI_OCR = str.maketrans({"O": "0", "I": "1", "L": "1"})
+
+
+def chiave_canonica(codice: str) -> str:
+    """
+    Chiave canonica tollerante agli errori di lettura: uppercase, confusioni OCR
+    (O/0, I/L/1) ricondotte allo stesso carattere e separatori (punti, underscore,
+    trattini, spazi) rimossi. Es. 'CAM25_MT.L11' e 'CAM25_MTL.11' hanno la stessa chiave.
+    """
+    if not codice:
+        return ""
+    c = re.sub(r'[\s._\-]+', '', codice.upper())
+    return c.translate(CONFUSIONI_OCR)
+
+
+def _cancellazioni(chiave: str):
+    """Tutte le varianti di una chiave ottenute eliminando un solo carattere."""
+    return {chiave[:i] + chiave[i + 1:] for i in range(len(chiave))}
+
+
+def _una_cancellazione(lunga: str, corta: str) -> bool:
+    """True se `corta` si ottiene da `lunga` eliminando un solo carattere."""
+    if len(lunga) != len(corta) + 1:
+        return False
+    i = 0
+    while i < len(corta) and lunga[i] == corta[i]:
+        i += 1
+    return lunga[i + 1:] == corta[i:]
+
+
+# Variante di cancellazione condivisa da piu' voci: i candidati si ricavano con una scansione
+_VARIANTE_CONDIVISA = object()
+
+
+class IndiceCanonico:
+    """
+    Indice precomputato {chiave_canonica: [chiavi xcode]} per il lookup O(1) tollerante
+    alle confusioni OCR, con chiavi alternative che tollerano un carattere in piu' o in meno
+    (solo per codici di almeno `lunghezza_minima` caratteri, per limitare i falsi positivi).
+
+    Le varianti di cancellazione sono una per carattere di ogni codice, quindi l'indice
+    ne conserva una sola chiave xcode; le varianti condivise da piu' voci (rare) sono
+    marcate e risolte scandendo le chiavi canoniche al momento della ricerca.
+    """
+
+    def __init__(self, tariffario: dict, lunghezza_minima: int = 6):
+        self.lunghezza_minima = lunghezza_minima
+        self.esatte = {}
+        self.cancellazioni = {}
+        for xcode in tariffario:
+            canonica = chiave_canonica(xcode)
+            self.esatte.setdefault(canonica, []).append(xcode)
+            if len(canonica) >= lunghezza_minima:
+                for variante in _cancellazioni(canonica):
+                    if self.cancellazioni.setdefault(variante, xcode) != xcode:
+                        self.cancellazioni[variante] = _VARIANTE_CONDIVISA
+
+    def collisioni(self) -> dict:
+        """Chiavi canoniche condivise da piu' voci del tariffario."""
+        return {k: v for k, v in self.esatte.items() if len(v) > 1}
+
+    def cerca(self, xcode: str) -> list[str]:
+        """
+        Cerca le voci del tariffario compatibili con il codice.
+
+        Returns:
+            Lista ordinata delle chiavi candidate: vuota se nessuna, un elemento se il match
+            e' univoco, piu' elementi in caso di collisione (da segnalare, non da scegliere).
+        """
+        canonica = chiave_canonica(xcode)
+        if canonica in self.esatte:
+            return sorted(set(self.esatte[canonica]))
+        if len(canonica) < self.lunghezza_minima:
+            return []
+
+        candidati = set()
+        # Carattere mancante nel codice letto
+        voce = self.cancellazioni.get(canonica)
+        if voce is _VARIANTE_CONDIVISA:
+            for chiave, xcodes in self.esatte.items():
+                if _una_cancellazione(chiave, canonica):
+                    candidati.update(xcodes)
+        elif voce is not None:
+            candidati.add(voce)
+        # Carattere in piu' nel codice letto
+        for variante in _cancellazioni(canonica):
+            candidati.update(self.esatte.get(variante, ()))
+        return sorted(candidati)
+
+
+def mappa_normalizzata(tariffario: dict) -> dict:
+    """Mappa precomputata {codice_normalizzato: chiave_xcode}; a parita' di normalizzazione vale la prima voce."""
+    tariffario_norm = {}
+    for xcode in tariffario:
+        tariffario_norm.setdefault(normalizza_codice(xcode), xcode)
+    return tariffario_norm
+
+
 def trova_codice_simile(
     xcode: str,
     tariffario: dict,
     tariffario_norm: dict | None = None,
     soglia: float = 0.85,
+    escludi=(),
 ) -> str | None:
     """
     Cerca un codice simile nel tariffario usando similarita' di stringa.
@@ -58,6 +158,7 @@ def trova_codice_simile(
         tariffario: dizionario {xcode: voce}
         tariffario_norm: mappa precomputata {codice_normalizzato: chiave_xcode} (opzionale)
         soglia: soglia minima di similarita' per il match fuzzy (default 0.85)
+        escludi: chiavi xcode da non proporre (es. alias rifiutati)
 
     Returns:
         La chiave xcode del tariffario che corrisponde, o None.
@@ -67,12 +168,12 @@ def trova_codice_simile(
     # 1. Match con normalizzazione aggressiva
     if tariffario_norm is not None:
         # Lookup O(1) con mappa precomputata
-        if xcode_norm in tariffario_norm:
+        if xcode_norm in tariffario_norm and tariffario_norm[xcode_norm] not in escludi:
             return tariffario_norm[xcode_norm]
     else:
         # Fallback: scansione lineare
         for chiave_tariffario in tariffario:
-            if normalizza_codice(chiave_tariffario) == xcode_norm:
+            if chiave_tariffario not in escludi and normalizza_codice(chiave_tariffario) == xcode_norm:
                 return chiave_tariffario
 
     # 2. Fallback: similarita' di stringa (SequenceMatcher)
@@ -80,6 +181,8 @@ def trova_codice_simile(
     miglior_score = 0.0
 
     for chiave_tariffario in tariffario:
+        if chiave_tariffario in escludi:
+            continue
         score = SequenceMatcher(None, xcode_norm, normalizza_codice(chiave_tariffario)).ratio()
         if score > miglior_score:
             miglior_score = score
@@ -0,0 +1,139 @@
+import re
+
+# Tipi di pagina: solo le pagine "voci" vengono inviate a Claude
+VOCI = "voci"
+RIEPILOGO = "riepilogo"
+VUOTA = "vuota"
+
+MODALITA = ("off", "conservativo", "aggressivo")
+
+# Token che somigliano a un codice tariffario: almeno 6 caratteri con cifre e separatori;
+# lettere e cifre con almeno un separatore (es. A.01.018.09, CAM25_MT.L11.810.017,
+# 01.A01.A10.005, E01.001) oppure solo cifre con almeno due separatori, esclusi i numeri
+# con separatore delle migliaia e le date (es. 01.02.003 si', 1.234.567 e 15.03.2025 no)
+RE_CODICE = re.compile(r'''
+    ^(?=.{6,}$)(?=.*\d)
+    (?!(?:0?[1-9]|[12]\d|3[01])([./\-])(?:0?[1-9]|1[0-2])\1(?:\d{2}|\d{4})$)   # gg.mm.aaaa, gg/mm/aa
+    (?!\d{4}([./\-])(?:0?[1-9]|1[0-2])\2(?:0?[1-9]|[12]\d|3[01])$)             # aaaa-mm-gg
+    (?:
+        (?=.*[A-Za-z])[A-Za-z0-9]+(?:[._\-][A-Za-z0-9]+)+
+      | (?!\d{1,3}(?:\.\d{3})+$)\d+(?:[._\-]\d+){2,}
+    )$''', re.VERBOSE)
+RE_NUMERO = re.compile(r'^\d{1,3}(?:\.\d{3})*(?:,\d+)?$|^\d+(?:[.,]\d+)?$')
+
+PAROLE_RIEPILOGO = (
+    "riepilogo", "quadro economico", "totale complessivo", "importo complessivo",
+    "importo lavori", "il progettista", "il tecnico", "firma",
+)
+
+
+def conta_codici(parole) -> int:
+    """Numero di parole del text layer che hanno la forma di un codice tariffario."""
+    return sum(1 for p in parole if RE_CODICE.match(p))
+
+
+def _righe_orizzontali(page) -> int:
+    """Numero di segmenti orizzontali lunghi disegnati nella pagina (righe di tabella)."""
+    larghezza_min = page.rect.width * 0.3
+    righe = 0
+    for disegno in page.get_drawings():
+        for elemento in disegno["items"]:
+            if elemento[0] == "l":
+                p1, p2 = elemento[1], elemento[2]
+                if abs(p1.y - p2.y) < 1 and abs(p1.x - p2.x) >= larghezza_min:
+                    righe += 1
+            elif elemento[0] == "re":
+                rect = elemento[1]
+                if rect.height < 2 and rect.width >= larghezza_min:
+                    righe += 1
+    return righe
+
+
+def _statistiche_immagine(fitz, page, dpi=24):
+    """
+    Rendering a bassa risoluzione in scala di grigi.
+    Ritorna (frazione di pixel scuri, numero di righe orizzontali quasi tutte scure,
+    frazione dell'altezza della pagina occupata dal contenuto).
+    """
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY)
+    larghezza, altezza, campioni = pix.width, pix.height, pix.samples
+    scuri = 0
+    righe_tabella = 0
+    righe_con_contenuto = []
+    for y in range(altezza):
+        riga = campioni[y * pix.stride: y * pix.stride + larghezza]
+        scuri_riga = sum(1 for v in riga if v < 128)
+        scuri += scuri_riga
+        if scuri_riga >= larghezza * 0.6:
+            righe_tabella += 1
+        if scuri_riga >= larghezza * 0.01:
+            righe_con_contenuto.append(y)
+    if righe_con_contenuto:
+        altezza_contenuto = (righe_con_contenuto[-1] - righe_con_contenuto[0] + 1) / altezza
+    else:
+        altezza_contenuto = 0.0
+    return scuri / max(larghezza * altezza, 1), righe_tabella, altezza_contenuto
+
+
+def classifica_pagina(fitz, page, modalita: str = "conservativo") -> dict:
+    """
+    Classifica una pagina come 'voci' (tabella con codici), 'riepilogo' o 'vuota'
+    usando solo analisi locali: text layer, disegni vettoriali e statistiche dell'immagine.
+
+    In modalita' 'conservativo' una pagina viene scartata solo se e' chiaramente priva di voci
+    (bianca, oppure con testo senza codici, numeri ne' righe di tabella, oppure un riepilogo
+    senza codici); nel dubbio resta 'voci'.
+    In modalita' 'aggressivo' si scartano tutte le pagine con text layer privo di codici
+    e le scansioni con poco inchiostro e nessuna riga di tabella.
+
+    Ritorna un dict: {tipo, motivo, codici, caratteri, altezza_contenuto}, dove codici e' None
+    se la pagina non ha text layer e altezza_contenuto e' la frazione verticale occupata dal contenuto
+    (usati per stimare la densita' della pagina).
+    """
+    parole_pos = page.get_text("words")
+    parole = [w[4] for w in parole_pos]
+    caratteri = sum(len(p) for p in parole)
+    codici = conta_codici(parole) if caratteri else None
+    altezza_contenuto = None
+    if parole_pos:
+        altezza_contenuto = (max(w[3] for w in parole_pos) - min(w[1] for w in parole_pos)) / page.rect.height
+    risultato = {"codici": codici, "caratteri": caratteri, "altezza_contenuto": altezza_contenuto}
+
+    if modalita == "off":
+        return {**risultato, "tipo": VOCI, "motivo": "triage disattivato"}
+
+    testo = " ".join(parole).lower()
+    riepilogo = caratteri >= 40 and any(p in testo for p in PAROLE_RIEPILOGO)
+    # Un solo token a forma di codice (es. un riferimento nel testo) non basta a smentire un riepilogo
+    if codici and (codici > 1 or not riepilogo):
+        return {**risultato, "tipo": VOCI, "motivo": f"{codici} codici nel text layer"}
+
+    if caratteri >= 40:
+        # Pagina con testo ma senza codici: copertina, riepilogo, firme...
+        if modalita == "conservativo" and not riepilogo:
+            # Codici in formati non previsti: basta la presenza di importi o di righe di tabella
+            numeri = sum(1 for p in parole if RE_NUMERO.match(p))
+            if numeri >= 5 or _righe_orizzontali(page) >= 5:
+                return {**risultato, "tipo": VOCI, "motivo": "numeri o tabella senza codici riconosciuti"}
+        motivo = "parole di riepilogo" if riepilogo else "testo senza codici"
+        return {**risultato, "tipo": RIEPILOGO, "motivo": motivo}
+
+    # Nessun text layer: pagina scansionata o bianca
+    inchiostro, righe_tabella, altezza_contenuto = _statistiche_immagine(fitz, page)
+    risultato["altezza_contenuto"] = altezza_contenuto
+    if inchiostro < 0.002:
+        return {**risultato, "tipo": VUOTA, "motivo": f"pagina bianca ({inchiostro:.2%} inchiostro)"}
+    if modalita == "aggressivo" and inchiostro < 0.03 and righe_tabella == 0:
+        return {**risultato, "tipo": VUOTA, "motivo": f"scansione con poco contenuto ({inchiostro:.2%} inchiostro)"}
+    return {**risultato, "tipo": VOCI, "motivo": "scansione: nessun text layer da analizzare"}
+
+
+def stima_token_pagina(page, dpi: int, token_prompt: int = 0) -> int:
+    """
+    Stima dei token di input di una pagina inviata come immagine, secondo il ridimensionamento
+    dell'API (lato lungo <= 1568 px, ~1.15 megapixel, token ~ pixel / 750) piu' il prompt di sistema.
+    """
+    zoom = dpi / 72
+    larghezza, altezza = page.rect.width * zoom, page.rect.height * zoom
+    scala = min(1.0, 1568 / max(larghezza, altezza), (1_150_000 / (larghezza * altezza)) ** 0.5)
+    return int(larghezza * scala * altezza * scala / 750) + token_prompt